@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Ranked address variants to try, one after another, when geocoding a UK address fails as written.
+
+Variants come out most-likely-to-succeed first: the full address, the usual trims of the first
+and/or last part, the street/town/postcode core of the address, the postcode alone, and only then
+other subsets of the comma-separated parts, largest first. Each variant appears once. The
+generator is lazy, so a caller that stops after N queries never pays for enumerating the rest.
+"""
+import re
+from itertools import combinations
+
+UK_POSTCODE_RE = re.compile(r"\b([A-Z]{1,2}[0-9][A-Z0-9]?)\s*([0-9][A-Z]{2})\b", re.IGNORECASE)
+# A house number followed by a street name, e.g. "10 Downing Street" or "1a High St"
+STREET_RE = re.compile(r"^\d+[a-z]?(-\d+)?\s+[^\d\s]", re.IGNORECASE)
+
+
+def join_address_parts(parts):
+    # Join non-empty, stripped parts with a comma and a space.
+    filtered = [p.strip() for p in parts if p.strip()]
+    return ", ".join(filtered) if filtered else ""
+
+
+def find_postcode(parts):
+    """Return (index of the part containing a UK postcode, the postcode), or (None, None)."""
+    for i, part in enumerate(parts):
+        match = UK_POSTCODE_RE.search(part)
+        if match:
+            return i, f"{match.group(1)} {match.group(2)}".upper()
+    return None, None
+
+
+def core_parts(parts):
+    """
+    Pick out (street, town, postcode) from address parts, any of which may be None.
+    The street is the first part that starts with a house number (failing that, the first part
+    with a number in it other than the postcode) and the town is the part just before the
+    postcode, or the second to last part if there is no postcode.
+    """
+    postcode_index, postcode = find_postcode(parts)
+    others = [p for i, p in enumerate(parts) if i != postcode_index]
+    street = next((p for p in others if STREET_RE.match(p)), None) or next((p for p in others if re.search(r"\d", p)), None)
+    if postcode_index is not None:
+        town_index = postcode_index - 1
+    else:
+        town_index = len(parts) - 2
+    town = parts[town_index] if 0 <= town_index < len(parts) and parts[town_index] != street else None
+    return street, town, postcode
+
+
+def generate_address_variants(address):
+    """Yield the variants of an address to try, best first, without repeats."""
+    parts = [p.strip() for p in address.split(",") if p.strip()]
+    seen = set()
+
+    def candidates():
+        yield address
+        if len(parts) > 1:
+            yield join_address_parts(parts[:-1])
+            yield join_address_parts(parts[1:])
+        if len(parts) > 2:
+            yield join_address_parts(parts[1:-1])
+
+        street, town, postcode = core_parts(parts)
+        yield join_address_parts([p for p in (street, town, postcode) if p])
+        if street and postcode:
+            yield join_address_parts([street, postcode])
+        if street and town:
+            yield join_address_parts([street, town])
+        if postcode:
+            yield postcode
+
+        # Everything else: every other subset of the parts (in their original order), largest first.
+        for size in range(len(parts) - 1, 0, -1):
+            for subset in combinations(parts, size):
+                yield join_address_parts(subset)
+
+    for candidate in candidates():
+        key = candidate.lower()
+        if candidate and key not in seen:
+            seen.add(key)
+            yield candidate
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for the stages that need no API, on synthetic data (see synthetic_data.py).
+
+    python benchmark.py                        # 10k snapshot lines
+    python benchmark.py --scale 1m             # 1m or 10m, or any number of lines
+    python benchmark.py remove_uk_pscs add_dissolution
+
+The data for each scale is generated once, into BENCHMARK_DIR/<scale>, and reused (10m is about
+9 GB and takes ten minutes or so to generate). The stages are run there as pscs_pipeline.py
+runs them - each its own process, with its usual files, its output logged - and timed. The paid
+stages in between are replaced by stand-ins that add what they would, and the postcode index is
+rebuilt (and timed) before the postcode stage.
+
+Each stage's seconds, records in and out, records per second and peak memory are appended to
+BENCHMARK_RESULTS_FILE, with the commit and machine and the stage's own metrics report (its
+counters, timers and CPU time - see metrics.py), and compared with the last run at the same
+scale on the same machine. A stage more than REGRESSION_THRESHOLD (and REGRESSION_MIN_SECONDS)
+slower is flagged.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pipeline_io import read_records
+from pscs_pipeline import STAGES
+import synthetic_data
+
+BENCHMARK_DIR = "bench_data"
+BENCHMARK_RESULTS_FILE = "benchmark_results.jsonl"
+BENCHMARK_LOG_DIR = "benchmark_logs"
+SCALES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+# Slower than the last run by more than this share, and this many seconds, is a regression
+REGRESSION_THRESHOLD = 0.10
+REGRESSION_MIN_SECONDS = 0.5
+RSS_POLL_SECONDS = 0.02
+
+# The stages timed, in pipeline order. Before a stage in STAND_INS, its input is made from the
+# previous stage's output by the stand-in for the paid stages skipped in between.
+BENCHMARK_STAGES = ["find_non_uk_corporates", "remove_uk_pscs", "remove_uk_listed", "add_dissolution",
+                    "remove_us_listed", "build_postcode_index", "geolocate_by_postcode", "remove_global_listed",
+                    "export_web"]
+STAND_INS = {
+    "remove_uk_pscs": synthetic_data.stand_in_for_names_and_geodata,
+    "geolocate_by_postcode": synthetic_data.stand_in_for_uk_addresses,
+}
+# Not a pipeline stage: the postcode stage builds the index if it needs to, but timing it
+# separately keeps the lookups' throughput comparable
+BUILD_POSTCODE_INDEX = {"name": "build_postcode_index", "script": "postcode_index.py", "inputs": [], "outputs": []}
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def count_records(path):
+    """Records in a stage's input or output: lines, except in a .json array."""
+    if path.endswith(".json"):
+        return sum(1 for _ in read_records(path))
+    count = 0
+    with open(path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            count += block.count(b"\n")
+    return count
+
+
+def read_peak_rss_mb(pid):
+    """A running process's peak RSS so far, from /proc (Linux only), or None."""
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def run_timed(command, cwd, log_file):
+    """
+    Run a command, logging its output. Returns (succeeded, seconds, peak RSS in MB or None).
+    (The peak is polled rather than taken from the child's rusage, which on Linux also counts
+    the memory of this process, that it was forked from.)
+    """
+    start = time.perf_counter()
+    peak_rss_mb = None
+    with open(log_file, "w", encoding="utf-8") as log:
+        process = subprocess.Popen(command, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+        while process.poll() is None:
+            peak_rss_mb = read_peak_rss_mb(process.pid) or peak_rss_mb
+            time.sleep(RSS_POLL_SECONDS)
+    return process.returncode == 0, time.perf_counter() - start, peak_rss_mb
+
+
+def read_stage_metrics(output_path):
+    """The parts of a stage's metrics report (see metrics.py) worth keeping with its timing, or None."""
+    try:
+        with open(f"{output_path}.metrics.json", "r", encoding="utf-8") as f:
+            report = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return {key: report.get(key) for key in ("cpu_seconds", "counters", "cache_hit_rates", "timers")}
+
+
+def prepare_data(directory, records, seed):
+    """Generate the synthetic data in directory, unless it's already there with the same parameters."""
+    manifest = synthetic_data.read_manifest(directory)
+    if manifest and manifest["records"] == records and manifest["seed"] == seed:
+        print(f"Using the synthetic data in {directory}")
+        return manifest
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    print(f"Generating {records:,} synthetic snapshot lines in {directory}")
+    start = time.perf_counter()
+    manifest = synthetic_data.generate(directory, records, seed)
+    print(f"Generated in {time.perf_counter() - start:.1f}s")
+    return manifest
+
+
+def run_benchmark(directory, names):
+    """Run the benchmark stages in directory. Returns {stage name: result}; stops at the first failure."""
+    stages = {stage["name"]: stage for stage in STAGES}
+    stages[BUILD_POSTCODE_INDEX["name"]] = BUILD_POSTCODE_INDEX
+    os.makedirs(os.path.join(directory, BENCHMARK_LOG_DIR), exist_ok=True)
+    results = {}
+    # Stages before those asked for still run, to make their inputs, but aren't reported
+    last = max(BENCHMARK_STAGES.index(name) for name in names) if names else len(BENCHMARK_STAGES) - 1
+    previous_output = synthetic_data.PSC_SNAPSHOT_FILE
+    for name in BENCHMARK_STAGES[:last + 1]:
+        stage = stages[name]
+        command = [sys.executable, os.path.join(REPO_DIR, stage["script"])]
+        if stage["outputs"]:
+            input_file = previous_output
+            if name in STAND_INS:
+                input_file = stage["inputs"][0]
+                print(f"{name}: making its input with the stand-in for the paid stages before it")
+                STAND_INS[name](os.path.join(directory, previous_output), os.path.join(directory, input_file),
+                                os.path.join(directory, synthetic_data.SNAPSHOT_FILE))
+            command += ["--input", input_file, "--output", stage["outputs"][0]]
+            previous_output = stage["outputs"][0]
+        succeeded, seconds, peak_rss_mb = run_timed(
+            command, directory, os.path.join(directory, BENCHMARK_LOG_DIR, f"{name}.log"))
+        if not succeeded:
+            print(f"{name}: FAILED, see {os.path.join(directory, BENCHMARK_LOG_DIR, name + '.log')}")
+            results[name] = {"failed": True, "seconds": round(seconds, 3)}
+            break
+        result = {"seconds": round(seconds, 3),
+                  "peak_rss_mb": round(peak_rss_mb, 1) if peak_rss_mb is not None else None}
+        if stage["outputs"]:
+            result["records_in"] = count_records(os.path.join(directory, input_file))
+            result["records_out"] = count_records(os.path.join(directory, stage["outputs"][0]))
+            result["records_per_second"] = round(result["records_in"] / max(seconds, 1e-9), 1)
+            result["metrics"] = read_stage_metrics(os.path.join(directory, stage["outputs"][0]))
+        print(f"{name}: {seconds:.2f}s")
+        if not names or name in names:
+            results[name] = result
+    return results
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=REPO_DIR,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if dirty else commit
+
+
+def load_results(path=BENCHMARK_RESULTS_FILE):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous_result(history, run):
+    """The last stored run at the same scale on the same machine, or None."""
+    for past in reversed(history):
+        if past["records"] == run["records"] and past["machine"] == run["machine"]:
+            return past
+    return None
+
+
+def print_report(run, previous):
+    """Print the run's results beside the previous run's. Returns the names of the stages that regressed."""
+    regressions = []
+    print("")
+    print(f"{'stage':<25} {'seconds':>9} {'records/s':>12} {'peak MB':>9} {'previous':>9} {'change':>8}")
+    for name, result in run["stages"].items():
+        if result.get("failed"):
+            print(f"{name:<25} {'FAILED':>9}")
+            continue
+        records_per_second = f"{result['records_per_second']:,.0f}" if "records_per_second" in result else ""
+        peak = f"{result['peak_rss_mb']:,.0f}" if result["peak_rss_mb"] is not None else ""
+        line = f"{name:<25} {result['seconds']:>9.2f} {records_per_second:>12} {peak:>9}"
+        before = (previous or {}).get("stages", {}).get(name)
+        if before and not before.get("failed"):
+            change = result["seconds"] / max(before["seconds"], 1e-9) - 1
+            line += f" {before['seconds']:>9.2f} {change:>+8.1%}"
+            if change > REGRESSION_THRESHOLD and result["seconds"] - before["seconds"] > REGRESSION_MIN_SECONDS:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+    if previous:
+        print(f"Compared with {previous['commit']} at {previous['timestamp']}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time the pipeline's offline stages on synthetic data.")
+    parser.add_argument("stages", nargs="*", help=f"stages to report (default: all of {', '.join(BENCHMARK_STAGES)})")
+    parser.add_argument("--scale", default="10k", help="10k, 1m, 10m or a number of snapshot lines")
+    parser.add_argument("--seed", type=int, default=synthetic_data.SYNTHETIC_SEED)
+    parser.add_argument("--no-save", action="store_true", help=f"don't add the results to {BENCHMARK_RESULTS_FILE}")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 if a stage regressed")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.stages if name not in BENCHMARK_STAGES]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+    records = SCALES.get(args.scale.lower()) or int(args.scale)
+    directory = os.path.join(BENCHMARK_DIR, args.scale.lower())
+
+    manifest = prepare_data(directory, records, args.seed)
+    results = run_benchmark(directory, args.stages)
+
+    run = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "scale": args.scale.lower(),
+        "records": records,
+        "seed": args.seed,
+        "machine": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "data": manifest,
+        "stages": results,
+    }
+    regressions = print_report(run, previous_result(load_results(), run))
+    if not args.no_save:
+        with open(BENCHMARK_RESULTS_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(run) + "\n")
+        print(f"Results added to {BENCHMARK_RESULTS_FILE}")
+
+    failed = any(result.get("failed") for result in results.values())
+    sys.exit(1 if failed or (args.fail_on_regression and regressions) else 0)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Crash-safe progress for the paid stages, so a crash, Ctrl-C or network outage hours into a run
+doesn't throw away the API and geocoder calls already made.
+
+A stage records each result as it gets it - a company's details, an address's coordinates -
+in a write-ahead progress log next to its output (the output name plus .progress): one JSON
+line per result, appended as it comes and fsync'd every CHECKPOINT_EVERY results or
+CHECKPOINT_SECONDS seconds, so the cost is one small write per result and an occasional sync.
+When the stage is run again it reads the log back, only does the work for what isn't in it,
+and deletes the log once its output has been written (which is itself atomic - see
+pipeline_io.write_records).
+
+The log starts with the size and modification time of the stage's input, and is ignored if the
+input has changed since. A line cut short by a crash is dropped when the log is read.
+"""
+import json
+import os
+import time
+from metrics import log
+
+CHECKPOINT_EVERY = 100
+CHECKPOINT_SECONDS = 10
+
+
+def progress_log_path(output_file):
+    return f"{output_file}.progress"
+
+
+def _input_signature(input_file):
+    stat = os.stat(input_file)
+    return {"input": os.path.basename(input_file), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class ProgressLog:
+    """
+    Append-only log of a stage's completed results, keyed by e.g. company number.
+    Results must be JSON-serializable; tuples come back as lists.
+    """
+
+    def __init__(self, output_file, input_file, every=CHECKPOINT_EVERY, seconds=CHECKPOINT_SECONDS):
+        self.path = progress_log_path(output_file)
+        self.every = every
+        self.seconds = seconds
+        self.done = {}
+        signature = _input_signature(input_file)
+        good_length = self._load(signature)
+        if good_length is None:
+            # No log, or one for a different input: start a new one
+            self._file = open(self.path, "w", encoding="utf-8")
+            self._file.write(json.dumps(signature) + "\n")
+            self._sync()
+        else:
+            os.truncate(self.path, good_length)
+            self._file = open(self.path, "a", encoding="utf-8")
+            log.info("Resuming: %d results already in %s", len(self.done), self.path)
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _load(self, signature):
+        """Read an existing log into self.done. Returns the length of its intact part, or None if unusable."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return None
+        with f:
+            header = f.readline()
+            try:
+                if json.loads(header) != signature:
+                    log.warning("Ignoring %s: the input has changed since it was written", self.path)
+                    return None
+            except ValueError:
+                return None
+            good_length = len(header)
+            for line in f:
+                try:
+                    key, result = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                self.done[key] = result
+                good_length += len(line)
+        return good_length
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def __len__(self):
+        return len(self.done)
+
+    def items(self):
+        return self.done.items()
+
+    def record(self, key, result):
+        """Log a completed result; it's durable by the next checkpoint."""
+        self.done[key] = result
+        self._file.write(json.dumps([key, result], ensure_ascii=False) + "\n")
+        self._unsynced += 1
+        if self._unsynced >= self.every or time.monotonic() - self._last_sync >= self.seconds:
+            self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        """Checkpoint and close, keeping the log (e.g. when stopping part way through)."""
+        if not self._file.closed:
+            self._sync()
+            self._file.close()
+
+    def finish(self):
+        """The stage's output is written: the log is no longer needed."""
+        self._file.close()
+        os.remove(self.path)
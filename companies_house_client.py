@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Client for the Companies House public data API, shared by the stages that fetch company profiles.
+
+- One requests.Session with a connection pool per worker thread, so connections are reused.
+- Requests from all threads are paced by one token bucket set to the documented limit of
+  600 requests per 5 minutes, and the pace is adjusted from the X-Ratelimit-* headers on every
+  response. A 429 pauses every thread until the window resets, and is retried up to
+  max_rate_limited times for the same request.
+- 404 is final (the company doesn't exist); other failures, including a 200 whose body isn't
+  JSON, are retried with exponential backoff.
+- Company profiles can be kept in an on-disk CompanyProfileCache, so they're fetched once per TTL;
+  with offline=True only the cache is used, expired profiles included, and nothing is requested.
+- Counts requests by outcome and records their latency (see metrics.py).
+
+COMPANIES_HOUSE_API_URL, if set in the environment, replaces the API's address - to point the
+client at a local stand-in (see mock_services.py).
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+from metrics import log
+from rate_limit import TokenBucket, backoff_delay
+
+COMPANIES_HOUSE_API_URL = os.environ.get("COMPANIES_HOUSE_API_URL", "https://api.company-information.service.gov.uk")
+
+# https://developer-specs.company-information.service.gov.uk/guides/rateLimiting
+RATE_LIMIT_REQUESTS = 600
+RATE_LIMIT_WINDOW = 300
+
+
+class CompaniesHouseError(Exception):
+    pass
+
+
+class CompaniesHouseClient:
+    def __init__(self, api_key, max_workers=4, base_url=COMPANIES_HOUSE_API_URL, timeout=30, max_retries=20,
+                 max_rate_limited=10, cache=None, offline=False):
+        self.cache = cache
+        self.offline = offline
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_rate_limited = max_rate_limited
+        self.max_workers = max_workers
+        self.session = requests.Session()
+        self.session.auth = (api_key, "")
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # A small burst allowance, then the average rate the API allows
+        self.rate_limiter = TokenBucket(RATE_LIMIT_REQUESTS / RATE_LIMIT_WINDOW, capacity=max_workers)
+        self.latency = metrics.histogram("companies_house.latency_seconds")
+        self._started = time.monotonic()
+
+    def _count(self, key):
+        metrics.count(f"companies_house.{key}")
+
+    def _adapt_to_rate_limit_headers(self, response):
+        """
+        Spread the requests remaining in the current window over the time left in it, or after a
+        429 or with none left, pause until the window resets (a minute if we aren't told when).
+        Companies House reports these as X-Ratelimit-Remain and X-Ratelimit-Reset (a Unix time).
+        """
+        try:
+            remaining = int(response.headers["X-Ratelimit-Remain"])
+        except (KeyError, ValueError):
+            remaining = None
+        try:
+            reset_in = float(response.headers["X-Ratelimit-Reset"]) - time.time()
+        except (KeyError, ValueError):
+            reset_in = None
+        if response.status_code == 429 or (remaining is not None and remaining <= 0):
+            self.rate_limiter.pause(max(reset_in, 1) if reset_in is not None else 60)
+        elif remaining is not None and reset_in is not None and reset_in > 0:
+            self.rate_limiter.set_rate(max(remaining / reset_in, 0.1))
+
+    def get(self, path):
+        """
+        GET an API path and return the decoded JSON, or None if it's a 404.
+        Raises CompaniesHouseError if the request still fails after max_retries retries, or is
+        still rate limited after max_rate_limited.
+        """
+        url = f"{self.base_url}{path}"
+        attempt = rate_limited = 0
+        while True:
+            self.rate_limiter.acquire()
+            self._count("requests")
+            start = time.monotonic()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+                error = None
+            except requests.RequestException as e:
+                response, error = None, e
+            finally:
+                self.latency.record(time.monotonic() - start)
+
+            if response is not None:
+                # (On a 429 this pauses every thread until the window resets)
+                self._adapt_to_rate_limit_headers(response)
+                if response.status_code == 200:
+                    try:
+                        data = response.json()
+                    except ValueError:
+                        # e.g. an HTML error page from a proxy in front of the API
+                        error = "HTTP 200 with a body that isn't JSON"
+                    else:
+                        self._count("ok")
+                        return data
+                elif response.status_code == 404:
+                    self._count("not_found")
+                    return None
+                elif response.status_code == 429:
+                    self._count("rate_limited")
+                    rate_limited += 1
+                    if rate_limited > self.max_rate_limited:
+                        raise CompaniesHouseError(f"Giving up on {path}: still rate limited after {self.max_rate_limited} retries")
+                    continue
+                else:
+                    error = f"HTTP {response.status_code}"
+
+            self._count("errors")
+            attempt += 1
+            if attempt > self.max_retries:
+                raise CompaniesHouseError(f"Giving up on {path}: {error}")
+            delay = backoff_delay(attempt)
+            log.warning("Error fetching %s: %s. Retrying in %.1f seconds...", path, error, delay)
+            time.sleep(delay)
+
+    def get_company_profile(self, company_number):
+        """
+        The /company/{company_number} profile, or None if Companies House doesn't know the company
+        (or, offline, if it isn't in the cache).
+        """
+        if self.cache is not None:
+            # Offline the cache is all there is, so an expired profile is better than none
+            cached, profile = self.cache.get(company_number, ignore_ttl=self.offline)
+            if cached:
+                self._count("cache_hits")
+                return profile
+            self._count("cache_misses")
+        if self.offline:
+            self._count("offline_misses")
+            return None
+        profile = self.get(f"/company/{company_number}")
+        if self.cache is not None:
+            self.cache.put(company_number, profile)
+        return profile
+
+    def get_company_profiles(self, company_numbers):
+        """
+        Fetch profiles for many companies at once, max_workers requests in flight.
+        Yields (company_number, profile) as each finishes, so one slow or rate-limited company
+        doesn't hold back the ones after it. If the caller stops early (or is interrupted),
+        requests not yet started are cancelled rather than waited for.
+        """
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            futures = {executor.submit(self.get_company_profile, company_number): company_number
+                       for company_number in company_numbers}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def prefetch(self, company_numbers):
+        """Fill the cache with every profile among company_numbers that isn't already there."""
+        if self.cache is None:
+            raise CompaniesHouseError("prefetch needs a cache")
+        missing = self.cache.missing(dict.fromkeys(company_numbers))
+        log.info("Prefetching %d company profiles not already cached", len(missing))
+        for _ in self.get_company_profiles(missing):
+            pass
+
+    def format_stats(self):
+        elapsed = max(time.monotonic() - self._started, 1e-9)
+        counts = {key: metrics.counter(f"companies_house.{key}") for key in
+                  ("requests", "ok", "not_found", "rate_limited", "errors", "cache_hits", "offline_misses")}
+        cached = f"{counts['cache_hits']} profiles from cache"
+        if self.offline:
+            cached += f", {counts['offline_misses']} not cached (offline)"
+        return (f"Companies House API: {counts['requests']} requests ({counts['requests'] / elapsed:.2f}/s), "
+                f"{counts['ok']} ok, {counts['not_found']} not found, {counts['rate_limited']} rate limited, "
+                f"{counts['errors']} errors; {cached}\n" + self.latency.format_summary("Companies House latency"))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of raw Companies House company profiles (GET /company/{company_number}).
+
+Profiles are stored content-addressed: each distinct profile is written once, as JSON, under
+objects/<first two hex digits>/<sha256>.json, and a small SQLite index maps company number ->
+(sha256, time fetched). A company Companies House doesn't know (404) is indexed with no profile.
+Entries older than the TTL are treated as missing, so they are fetched again.
+
+To fill the cache for every company in a stage's input before running it:
+    python company_profile_cache.py some_stage_input.jsonl
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pipeline_io import read_records
+
+PROFILE_CACHE_DIR = "companies_house_cache"
+# Profiles older than this are fetched again. None keeps them forever.
+PROFILE_CACHE_TTL_DAYS = 30
+# Company numbers looked up in the index per query (SQLite allows 999 parameters by default)
+INDEX_QUERY_BATCH = 500
+
+
+class CompanyProfileCache:
+    def __init__(self, directory=PROFILE_CACHE_DIR, ttl_days=PROFILE_CACHE_TTL_DAYS):
+        self.directory = directory
+        self.ttl_seconds = ttl_days * 24 * 60 * 60 if ttl_days is not None else None
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS profiles (company_number TEXT PRIMARY KEY, sha256 TEXT, fetched_at REAL)"
+        )
+        self._conn.commit()
+
+    def _expired(self, fetched_at):
+        return self.ttl_seconds is not None and time.time() - fetched_at > self.ttl_seconds
+
+    def _object_path(self, sha256):
+        return os.path.join(self.directory, "objects", sha256[:2], f"{sha256}.json")
+
+    def get(self, company_number, ignore_ttl=False):
+        """
+        Return (cached, profile). cached is False if the company isn't in the cache or its entry
+        has expired (unless ignore_ttl); profile is None if the company was not found by Companies House.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sha256, fetched_at FROM profiles WHERE company_number = ?", (company_number,)
+            ).fetchone()
+        if row is None:
+            return False, None
+        sha256, fetched_at = row
+        if not ignore_ttl and self._expired(fetched_at):
+            return False, None
+        if sha256 is None:
+            return True, None
+        try:
+            with open(self._object_path(sha256), "rb") as f:
+                return True, json.load(f)
+        except FileNotFoundError:
+            return False, None
+
+    def put(self, company_number, profile):
+        """Store a profile (or None for a company that doesn't exist)."""
+        sha256 = None
+        if profile is not None:
+            data = json.dumps(profile, sort_keys=True, separators=(",", ":")).encode("utf-8")
+            sha256 = hashlib.sha256(data).hexdigest()
+            path = self._object_path(sha256)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                temp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(temp_path, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO profiles (company_number, sha256, fetched_at) VALUES (?, ?, ?)",
+                (company_number, sha256, time.time()),
+            )
+
+    def missing(self, company_numbers):
+        """
+        The company numbers (in the order given) that would need fetching: not in the index, or
+        expired. Answered from the index alone, without reading the profiles.
+        """
+        company_numbers = list(company_numbers)
+        fetched_at = {}
+        for i in range(0, len(company_numbers), INDEX_QUERY_BATCH):
+            batch = company_numbers[i:i + INDEX_QUERY_BATCH]
+            with self._lock:
+                fetched_at.update(self._conn.execute(
+                    f"SELECT company_number, fetched_at FROM profiles WHERE company_number IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall())
+        return [number for number in company_numbers
+                if number not in fetched_at or self._expired(fetched_at[number])]
+
+    def close(self):
+        self._conn.close()
+
+
+def company_numbers_in_file(path):
+    """Distinct company numbers in a stage's input, in any format read_records reads (e.g. .jsonl.gz)."""
+    return list(dict.fromkeys(r["company_number"] for r in read_records(path) if r.get("company_number")))
+
+
+if __name__ == "__main__":
+    from companies_house_settings import companies_house_api_key
+    from companies_house_client import CompaniesHouseClient
+
+    client = CompaniesHouseClient(companies_house_api_key, cache=CompanyProfileCache())
+    for input_path in sys.argv[1:]:
+        company_numbers = company_numbers_in_file(input_path)
+        print(f"{input_path}: {len(company_numbers)} companies")
+        client.prefetch(company_numbers)
+    print(client.format_stats())
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Company details from the Companies House bulk snapshot (BasicCompanyData), and the plan for
+which companies still need the API.
+
+The snapshot has most of what we take from company profiles - name, status, dates, SIC codes,
+registered office, accounts type and next due date - so the API stages fill what they can from
+it and only call the API for companies the snapshot lacks, or for the fields only the API has
+(the registered office dispute / undeliverable flags). Those flags are only fetched for active
+companies: every other company is drawn black on the map whatever its flags.
+
+has_been_liquidated (which add_names drops companies on) is the API's "has ever been
+liquidated"; the snapshot only has the current status. So it's taken as True for a company in
+liquidation now and False for an active one - wrong only for an active company restored after
+a liquidation - and left out for any other status, sending those companies to the API for it.
+
+Values are as the snapshot has them (e.g. dates as dd/mm/yyyy, status "Active"), the same as
+pscs_add_dissolution_and_misc_data.py has always written.
+
+Parsing the 2+ GB CSV takes minutes, so it can be converted once to a zstd-compressed Parquet file
+(needs pyarrow), sorted by company number and with snake_case column names:
+    python company_snapshot.py
+After that, loading reads just the columns needed, for just the row groups that can hold the
+companies asked for, in seconds. Without the Parquet file (or pyarrow) the CSV is streamed.
+"""
+import csv
+import io
+import os
+import re
+import time
+from datetime import datetime
+import metrics
+from metrics import log, peak_rss_mb, format_rss
+from snapshot_files import iter_text_parts, open_part, snapshot_parts
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# snapshot from https://download.companieshouse.gov.uk/en_output.html
+# can also be the downloaded BasicCompanyDataAsOneFile-2025-03-01.zip, which is read without unzipping,
+# or a pattern matching the multi-part download e.g. 'BasicCompanyData-2025-03-01-part*.zip'
+SNAPSHOT_FILE = 'BasicCompanyDataAsOneFile-2025-03-01.csv'
+# The columnar copy of SNAPSHOT_FILE made by running this file
+SNAPSHOT_PARQUET_FILE = 'BasicCompanyData-2025-03-01.parquet'
+PARQUET_ROW_GROUP_SIZE = 100_000
+
+# Fields only the API has
+API_ONLY_FIELDS = ("registered_office_is_in_dispute", "undeliverable_registered_office_address")
+# The statuses from which we take has_been_liquidated to be known (see above)
+LIQUIDATION_STATUSES = {"Liquidation": True, "Active": False}
+
+# Columns by their normalized names (see normalize_column_name)
+SIC_FIELDS = ["sic_code_sic_text_1", "sic_code_sic_text_2", "sic_code_sic_text_3", "sic_code_sic_text_4"]
+ADDRESS_FIELDS = ["reg_address_address_line1", "reg_address_address_line2", "reg_address_post_town",
+                  "reg_address_county", "reg_address_post_code", "reg_address_country"]
+DETAILS_COLUMNS = ["company_name", "company_status", "incorporation_date", "dissolution_date",
+                   "accounts_account_category", "accounts_next_due_date"] + SIC_FIELDS + ADDRESS_FIELDS
+# The snapshot's accounts categories, as the API names them
+NO_ACCOUNTS_CATEGORY = "NO ACCOUNTS FILED"
+ACCOUNTS_TYPE_NOT_AVAILABLE = "ACCOUNTS TYPE NOT AVAILABLE"
+
+
+def normalize_column_name(name):
+    """' CompanyNumber' -> 'company_number', 'RegAddress.PostCode' -> 'reg_address_post_code', etc."""
+    name = re.sub(r"[.\s]+", "_", name.strip())
+    name = re.sub(r"(?<=[a-z0-9])(?=[A-Z])|(?<=[A-Z])(?=[A-Z][a-z])", "_", name)
+    return name.lower()
+
+
+def snapshot_date(path=SNAPSHOT_FILE):
+    """The date of a snapshot, from its file name (e.g. BasicCompanyDataAsOneFile-2025-03-01.csv)."""
+    match = re.search(r"(\d{4}-\d{2}-\d{2})", os.path.basename(path))
+    return datetime.strptime(match.group(1), "%Y-%m-%d").date() if match else None
+
+
+def parse_snapshot_date(value):
+    try:
+        return datetime.strptime(value, "%d/%m/%Y").date()
+    except ValueError:
+        return None
+
+
+def accounts_type_from_category(category):
+    if not category or category == NO_ACCOUNTS_CATEGORY:
+        return None
+    if category == ACCOUNTS_TYPE_NOT_AVAILABLE:
+        return "no-accounts-type-available"
+    return category.lower().replace(" ", "-")
+
+
+def details_from_row(row, columns, as_of):
+    """
+    Our company_details fields from one snapshot row, a list of values with `columns` mapping
+    column names to their positions (accounts_overdue only if we know the snapshot's date, and
+    has_been_liquidated only if the status tells us).
+    """
+    def value(name):
+        return row[columns[name]]
+
+    status = value("company_status")
+    details = {
+        "company_name": value("company_name"),
+        "company_status": status,
+        "incorporation_date": value("incorporation_date"),
+        # Convert empty strings to None for the dissolution date.
+        "dissolution_date": value("dissolution_date") or None,
+        # Concatenate SIC codes, only including non-empty values.
+        "SICs": ','.join(value(field) for field in SIC_FIELDS if value(field)),
+        "postcode": value("reg_address_post_code") or None,
+        "address": ', '.join(value(field) for field in ADDRESS_FIELDS if value(field)),
+        "accounts_type": accounts_type_from_category(value("accounts_account_category")),
+    }
+    if status in LIQUIDATION_STATUSES:
+        details["has_been_liquidated"] = LIQUIDATION_STATUSES[status]
+    if as_of is not None:
+        next_due = parse_snapshot_date(value("accounts_next_due_date"))
+        details["accounts_overdue"] = next_due is not None and next_due < as_of
+    return details
+
+
+def read_csv_snapshot(company_numbers, snapshot_file):
+    """
+    Stream the snapshot CSV, yielding (row, columns) for the wanted companies (all of them if
+    company_numbers is None).
+    Rows are parsed with a plain csv.reader and only the company number of each is looked at
+    until it matches one we want, so memory stays proportional to the companies we keep, not the
+    ~5 million in the snapshot. Each part of a multi-part snapshot has its own header row.
+    """
+    wanted = set(company_numbers) if company_numbers is not None else None
+    for csvfile in iter_text_parts(snapshot_file):
+        reader = csv.reader(csvfile)
+        columns = {normalize_column_name(name): i for i, name in enumerate(next(reader))}
+        number_column = columns["company_number"]
+        for row in reader:
+            if wanted is None or row[number_column] in wanted:
+                yield row, columns
+
+
+def parquet_is_current(parquet_file, snapshot_file):
+    """True if parquet_file exists and was built from snapshot_file, since it last changed."""
+    if pa is None or not os.path.exists(parquet_file):
+        return False
+    metadata = pq.read_schema(parquet_file).metadata or {}
+    if metadata.get(b"source") != snapshot_file.encode("utf-8"):
+        return False
+    return os.path.getmtime(parquet_file) >= max(os.path.getmtime(p) for p in snapshot_parts(snapshot_file))
+
+
+def build_snapshot_parquet(snapshot_file=SNAPSHOT_FILE, parquet_file=SNAPSHOT_PARQUET_FILE):
+    """Convert the snapshot to Parquet: every column as a string, normalized names, sorted by company number."""
+    if pa is None:
+        raise ImportError("Building the Parquet snapshot needs pyarrow (pip install pyarrow)")
+    log.info("Converting %s to %s", snapshot_file, parquet_file)
+    start = time.monotonic()
+    tables = []
+    for part in snapshot_parts(snapshot_file):
+        with open_part(part) as f:
+            header = next(csv.reader(io.TextIOWrapper(f, encoding="utf-8", newline="")))
+        names = [normalize_column_name(name) for name in header]
+        with open_part(part) as f:
+            tables.append(pa_csv.read_csv(
+                f,
+                read_options=pa_csv.ReadOptions(column_names=names, skip_rows=1),
+                convert_options=pa_csv.ConvertOptions(column_types={name: pa.string() for name in names},
+                                                     strings_can_be_null=False),
+            ))
+    table = pa.concat_tables(tables).sort_by("company_number")
+    table = table.replace_schema_metadata({"source": snapshot_file})
+    temp_file = f"{parquet_file}.tmp"
+    pq.write_table(table, temp_file, compression="zstd", row_group_size=PARQUET_ROW_GROUP_SIZE)
+    os.replace(temp_file, parquet_file)
+    log.info("Wrote %d companies to %s in %.1fs (%s MB)", table.num_rows, parquet_file, time.monotonic() - start,
+             f"{os.path.getsize(parquet_file) / 1e6:,.0f}")
+
+
+def read_parquet_snapshot(company_numbers=None, columns=None, parquet_file=SNAPSHOT_PARQUET_FILE):
+    """
+    Read the given columns (all if None) for the given companies (all if None) from the Parquet
+    snapshot, as a pyarrow Table that includes company_number. As the file is sorted by company
+    number, only row groups whose range of company numbers could hold a wanted one are read.
+    """
+    if columns is not None and "company_number" not in columns:
+        columns = ["company_number"] + list(columns)
+    filters = None
+    if company_numbers is not None:
+        filters = pc.field("company_number").isin(sorted(set(company_numbers)))
+    return pq.read_table(parquet_file, columns=columns, filters=filters)
+
+
+def load_company_snapshot(company_numbers=None, snapshot_file=SNAPSHOT_FILE, parquet_file=SNAPSHOT_PARQUET_FILE):
+    """
+    Load {company number: details} from the snapshot, for just the given companies if
+    company_numbers is given. Reads the Parquet copy if there is an up to date one, otherwise the CSV.
+    """
+    if company_numbers is not None:
+        company_numbers = list(company_numbers)
+    as_of = snapshot_date(snapshot_file)
+    snapshot = {}
+    use_parquet = parquet_is_current(parquet_file, snapshot_file)
+    source = parquet_file if use_parquet else snapshot_file
+    log.info("Loading snapshot %s (peak memory so far %s)", source, format_rss(peak_rss_mb()))
+    start = time.monotonic()
+    if use_parquet:
+        table = read_parquet_snapshot(company_numbers, DETAILS_COLUMNS, parquet_file)
+        columns = {name: i for i, name in enumerate(table.column_names)}
+        rows = zip(*(table.column(name).to_pylist() for name in table.column_names))
+        matches = ((row, columns) for row in rows)
+    else:
+        matches = read_csv_snapshot(company_numbers, snapshot_file)
+    with metrics.timer("load_company_snapshot"):
+        for row, columns in matches:
+            snapshot[row[columns["company_number"]]] = details_from_row(row, columns, as_of)
+    seconds = time.monotonic() - start
+    metrics.count("company_snapshot.companies_loaded", len(snapshot))
+    log.info("Loaded %d companies in %.1fs, peak memory %s", len(snapshot), seconds, format_rss(peak_rss_mb()))
+    return snapshot
+
+
+def plan_enrichment(company_numbers, snapshot, wanted_fields):
+    """
+    Split company_numbers into ({company number: details from the snapshot}, [company numbers to
+    fetch from the API]). A company goes to the API if it isn't in the snapshot, or if the snapshot
+    lacks a field we want - except that the API-only flags aren't wanted for inactive companies.
+    """
+    from_snapshot = {}
+    to_fetch = []
+    for company_number in dict.fromkeys(company_numbers):
+        details = snapshot.get(company_number)
+        if details is None:
+            to_fetch.append(company_number)
+            continue
+        missing = [field for field in wanted_fields if field not in details]
+        if details["company_status"] != "Active":
+            missing = [field for field in missing if field not in API_ONLY_FIELDS]
+        if missing:
+            to_fetch.append(company_number)
+        else:
+            from_snapshot[company_number] = {field: details[field] for field in wanted_fields if field in details}
+    metrics.count("company_snapshot.api_calls_avoided", len(from_snapshot))
+    log.info("%d companies filled from the snapshot (%d API calls avoided), %d to fetch from the API",
+             len(from_snapshot), len(from_snapshot), len(to_fetch))
+    return from_snapshot, to_fetch
+
+
+def snapshot_fields(company_numbers, snapshot, wanted_fields):
+    """
+    {company number: the wanted fields the snapshot has} for those of company_numbers in it - to
+    refresh details carried forward from a previous run (see psc_delta.py), which keep only
+    what the snapshot lacks.
+    """
+    return {company_number: {field: snapshot[company_number][field] for field in wanted_fields
+                             if field in snapshot[company_number]}
+            for company_number in dict.fromkeys(company_numbers) if company_number in snapshot}
+
+
+if __name__ == "__main__":
+    build_snapshot_parquet()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Persistent cache of geocoding results, stored in SQLite and keyed by canonicalized address.
+
+Paid geocoding is the most expensive part of the pipeline and the same registered-agent
+addresses recur thousands of times, so every answer - including "not found" - is kept,
+and reruns and monthly refreshes only pay for addresses that have never been seen before.
+"""
+import re
+import sqlite3
+import threading
+import time
+
+GEOCODE_CACHE_FILE = "geocode_cache.sqlite"
+
+
+def canonicalize_address(address):
+    """
+    Normalize an address so trivially different spellings share a cache entry:
+    lower case, single spaces, no empty parts, and ", " between parts.
+    """
+    parts = [re.sub(r"\s+", " ", part).strip() for part in address.lower().split(",")]
+    return ", ".join(part for part in parts if part)
+
+
+class GeocodeCache:
+    """
+    Maps canonical address -> (lat, lon, description). lat and lon are None for addresses the
+    geocoder couldn't find. Different geocoders should use different tables.
+    Can be shared between threads.
+    """
+
+    def __init__(self, path=GEOCODE_CACHE_FILE, table="geocodes"):
+        if not re.fullmatch(r"\w+", table):
+            raise ValueError(f"Invalid table name {table!r}")
+        self.table = table
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {table} ("
+            "address TEXT PRIMARY KEY, lat REAL, lon REAL, description TEXT, fetched_at REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, address):
+        """Return (lat, lon, description) for an address, or None if it has never been geocoded."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT lat, lon, description FROM {self.table} WHERE address = ?",
+                (canonicalize_address(address),),
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def put(self, address, lat, lon, description=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self.table} (address, lat, lon, description, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (canonicalize_address(address), lat, lon, description, time.time()),
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def close(self):
+        self._conn.close()
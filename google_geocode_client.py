@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Client for the Google geocoding API (through geopy), used by pscs_find_geodata.
+
+Safe to share between threads: every request waits for one token bucket, so together they make
+at most qps requests a second, and an error only makes the call that hit it back off and retry.
+Counts requests by outcome and records their latency, and the time spent backing off between
+retries, in separate histograms (see metrics.py).
+
+GOOGLE_GEOCODE_URL, if set in the environment, replaces Google's scheme and host - to point
+the client at a local stand-in (see mock_services.py).
+"""
+import logging
+import os
+import time
+from functools import partial
+from urllib.parse import urlsplit
+from urllib3.util.retry import Retry
+from geopy.adapters import RequestsAdapter
+from geopy.geocoders import GoogleV3
+from geopy.exc import GeocoderUnavailable, GeocoderTimedOut, GeocoderRateLimited, GeocoderQuotaExceeded
+import requests
+import metrics
+from metrics import log
+from rate_limit import TokenBucket, backoff_delay
+
+GOOGLE_GEOCODE_URL = os.environ.get("GOOGLE_GEOCODE_URL", "https://maps.googleapis.com")
+
+# Suppress verbose logging from geopy and underlying libraries
+logging.getLogger("geopy").setLevel(logging.CRITICAL)
+
+# Worth trying again: the service being down or slow, or HTTP 429 (too many requests)
+RETRYABLE_ERRORS = (GeocoderUnavailable, GeocoderTimedOut, GeocoderRateLimited,
+                    requests.exceptions.ConnectionError, TimeoutError)
+# Google also answers OVER_QUERY_LIMIT (GeocoderQuotaExceeded) to bursts over the per-second
+# limit, so that's tried again a few times - but it's mostly an exhausted daily quota or
+# billing, which waiting won't fix, so after that it's raised and stops the stage.
+QUOTA_EXCEEDED_RETRIES = 3
+
+
+class GoogleGeocodeClient:
+    def __init__(self, api_key, qps, base_url=GOOGLE_GEOCODE_URL):
+        url = urlsplit(base_url)
+        # geopy's default adapter has urllib3 sleep for a 429's Retry-After and try again itself;
+        # geocode() does that instead, so the wait isn't timed as the request's latency
+        adapter = partial(RequestsAdapter, max_retries=Retry(total=2, respect_retry_after_header=False))
+        self.geolocator = GoogleV3(api_key=api_key, domain=url.netloc, scheme=url.scheme, adapter_factory=adapter)
+        self.rate_limiter = TokenBucket(qps)
+        self.latency = metrics.histogram("google_geocode.latency_seconds")
+        self.backoff = metrics.histogram("google_geocode.backoff_seconds")
+
+    def geocode(self, address, max_retries=100, max_delay=60):
+        """
+        Attempt to geocode an address with retries.
+
+        Parameters:
+          address: The address string.
+          max_retries: Maximum number of retries before giving up.
+          max_delay: Longest delay in seconds between retries (delays double from 1 second).
+
+        Returns:
+          (location, succeeded): location is the geopy Location object, or None if the address wasn't
+          found or geocoding kept failing; succeeded is False only in the latter case.
+
+        Raises GeocoderQuotaExceeded if Google still answers OVER_QUERY_LIMIT after
+        QUOTA_EXCEEDED_RETRIES retries, and any error that isn't worth retrying.
+        """
+        retries = quota_retries = 0
+        while retries < max_retries:
+            self.rate_limiter.acquire()
+            metrics.count("google_geocode.requests")
+            start = time.monotonic()
+            try:
+                location = self.geolocator.geocode(address)
+                error = None
+            except RETRYABLE_ERRORS as e:
+                error = e
+            except GeocoderQuotaExceeded as e:
+                quota_retries += 1
+                if quota_retries > QUOTA_EXCEEDED_RETRIES:
+                    metrics.count("google_geocode.quota_exceeded")
+                    raise
+                error = e
+            finally:
+                # The request's own time; any backoff after it is recorded separately
+                self.latency.record(time.monotonic() - start)
+            if error is None:
+                return location, True
+
+            rate_limited = isinstance(error, (GeocoderRateLimited, GeocoderQuotaExceeded))
+            metrics.count("google_geocode.rate_limited" if rate_limited else "google_geocode.errors")
+            retries += 1
+            delay = backoff_delay(retries, maximum=max_delay)
+            if isinstance(error, GeocoderRateLimited) and error.retry_after:
+                delay = max(delay, error.retry_after)
+            # Only log a short error message without the traceback.
+            log.warning("Geocoding error for '%s': %s. Retrying %d/%d in %.1f seconds...",
+                        address, error, retries, max_retries, delay)
+            self.backoff.record(delay)
+            time.sleep(delay)
+        metrics.count("google_geocode.gave_up")
+        log.warning("Geocoding failed for address: %s", address)
+        return None, False
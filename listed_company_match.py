@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Fuzzy matching of PSC names against lists of listed companies, shared by pscs_remove_us_listed.py
+and pscs_remove_global_listed.py.
+
+A PSC counts as listed if fuzz.ratio of its normalized name and any normalized listing name is
+at least the threshold, exactly as when every pair was compared one at a time - but:
+  - exact matches are found with a set lookup
+  - fuzz.ratio is 100 * (1 - distance / (len(a) + len(b))) and the distance is at least the
+    difference in length, so only listings of a length that could reach the threshold are scored
+  - those are scored a block at a time with rapidfuzz's cdist, on every core, and any pair that
+    comes close is checked again with fuzz.ratio itself so that rounding can't change the result
+"""
+import math
+import re
+from bisect import bisect_left, bisect_right
+import numpy as np
+from rapidfuzz import fuzz, process
+
+DEFAULT_THRESHOLD = 95
+# PSC names scored against the listings at once (bounds the size of the score matrix)
+QUERY_BLOCK_SIZE = 256
+
+NON_ALPHANUMERIC_RE = re.compile(r'[^a-z0-9\s]')
+# Tokens to remove (as whole words)
+TOKENS_TO_REMOVE_RE = re.compile(r'\b(?:' + '|'.join(['inc', 'llc', 'ltd', 'corp', 'corporation', 'class', 'series']) + r')\b')
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text):
+    """Lowercase, remove punctuation, common corporate suffixes, class/series tokens, and extra whitespace."""
+    text = text.lower()
+    # Remove punctuation (keep alphanumerics and spaces)
+    text = NON_ALPHANUMERIC_RE.sub('', text)
+    text = TOKENS_TO_REMOVE_RE.sub('', text)
+    # Remove common stock if present
+    text = text.replace("common stock", "")
+    # Normalize whitespace
+    text = WHITESPACE_RE.sub(' ', text)
+    return text.strip()
+
+
+def load_listing_names(filename, delimiter, company_name_col, skip_header=True):
+    """
+    Load company names from a file.
+      - filename: path to file.
+      - delimiter: string delimiter.
+      - company_name_col: zero-based index for the company name column.
+      - skip_header: whether to skip the first line.
+    Returns a list of normalized company names.
+    """
+    listing_names = []
+    with open(filename, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            if skip_header and i == 0:
+                continue
+            parts = line.strip().split(delimiter)
+            if len(parts) > company_name_col:
+                name = parts[company_name_col]
+                normalized = normalize_text(name)
+                listing_names.append(normalized)
+    return listing_names
+
+
+class ListedCompanyMatcher:
+    def __init__(self, listing_names, threshold=DEFAULT_THRESHOLD):
+        """listing_names should already be normalized."""
+        self.threshold = threshold
+        self.exact = set(listing_names)
+        self.by_length = sorted(self.exact, key=len)
+        self.lengths = [len(name) for name in self.by_length]
+
+    def _length_window(self, length):
+        """The slice of self.by_length whose lengths leave a ratio of at least the threshold possible."""
+        t = self.threshold
+        shortest = math.floor(length * t / (200 - t))
+        longest = math.ceil(length * (200 - t) / t) if t > 0 else math.inf
+        return bisect_left(self.lengths, shortest), bisect_right(self.lengths, longest)
+
+    def _fuzzy_matches(self, names):
+        """The names (all of one length) that fuzzy match a listing."""
+        start, end = self._length_window(len(names[0]))
+        choices = self.by_length[start:end]
+        if not choices:
+            return set()
+        matched = set()
+        for i in range(0, len(names), QUERY_BLOCK_SIZE):
+            block = names[i:i + QUERY_BLOCK_SIZE]
+            scores = process.cdist(block, choices, scorer=fuzz.ratio, score_cutoff=max(self.threshold - 1, 0), workers=-1)
+            for row, col in zip(*np.nonzero(scores)):
+                name = block[row]
+                if name not in matched and fuzz.ratio(name, choices[col]) >= self.threshold:
+                    matched.add(name)
+        return matched
+
+    def match_many(self, psc_names):
+        """For each (raw) PSC name, whether it matches a listed company. Returns a list of bools in order."""
+        normalized = [normalize_text(name) for name in psc_names]
+        by_length = {}
+        for name in set(normalized) - self.exact:
+            by_length.setdefault(len(name), []).append(name)
+        fuzzy_matched = set()
+        for names in by_length.values():
+            fuzzy_matched |= self._fuzzy_matches(names)
+        return [name in self.exact or name in fuzzy_matched for name in normalized]
+
+    def is_listed_company(self, psc_name):
+        return self.match_many([psc_name])[0]
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Load test for the API clients, against the local stand-ins in mock_services.py.
+
+    python load_test.py                              # every client in every scenario
+    python load_test.py --clients companies_house --scenarios throttled --calls 1000
+
+For each scenario in SCENARIOS the mock services are started with the scenario's settings (in
+their own process, so they don't compete with the clients for the interpreter), and each client
+makes `calls` calls with the workers and rate limits the stages use: Companies House profiles,
+Google geocodes and Nominatim searches. For each it reports calls per second, the HTTP requests
+made (retries included), the errors and throttled requests among them, the calls given up on,
+and the p50/p95/p99 latency of single requests and of whole calls - which includes retries,
+backoff and waiting for the rate limiter (and, for Google, the backoff between retries on its
+own). Results are appended to LOAD_TEST_RESULTS_FILE.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import requests
+from benchmark import git_commit
+from companies_house_client import CompaniesHouseClient, CompaniesHouseError
+from google_geocode_client import GoogleGeocodeClient
+from nominatim_client import NominatimClient
+import metrics
+import mock_services
+
+LOAD_TEST_RESULTS_FILE = "load_test_results.jsonl"
+LOAD_TEST_CALLS = 300
+LOAD_TEST_PORT = 8799
+MOCK_START_SECONDS = 10
+
+# As the stages have them (CH_WORKERS, GEOCODE_WORKERS, NOMINATIM_WORKERS and GEOCODE_QPS)
+CLIENT_WORKERS = {"companies_house": 4, "google": 16, "nominatim": 8}
+GOOGLE_QPS = 25
+# Where each client counts its requests' outcomes (see metrics.py)
+METRIC_PREFIXES = {"companies_house": "companies_house", "google": "google_geocode", "nominatim": "nominatim"}
+
+# Settings for mock_services.py in every scenario. Companies House's five-minute window is
+# shortened, so a test shows the client's pacing adapting to it in seconds rather than minutes.
+BASE_SETTINGS = ["companies_house.rate_limit=300", "companies_house.rate_limit_window=10"]
+SCENARIOS = {
+    "normal": [],
+    "slow": ["latency_ms=300", "latency_sigma=1"],
+    "flaky": ["error_rate=0.05"],
+    "throttled": ["throttle_rate=0.05", "google.qps_limit=20"],
+}
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@contextmanager
+def running_mock_services(settings, port, seed):
+    """Run mock_services.py with settings while in the block. Yields its base URL."""
+    command = [sys.executable, os.path.join(REPO_DIR, "mock_services.py"), "--port", str(port), "--seed", str(seed)]
+    for setting in settings:
+        command += ["--set", setting]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + MOCK_START_SECONDS
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError("mock_services.py exited")
+            try:
+                requests.get(f"{base_url}/_stats", timeout=1)
+                break
+            except requests.ConnectionError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"mock_services.py didn't start within {MOCK_START_SECONDS}s")
+                time.sleep(0.1)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def mock_address(i):
+    return f"{i} Load Test Road, Testville, LT{i % 99 + 1} {i % 10}AA"
+
+
+def make_call(name, base_url):
+    """A function making the i'th call with a new client. Returns False if the call gave up."""
+    if name == "companies_house":
+        client = CompaniesHouseClient("load-test", max_workers=CLIENT_WORKERS[name], base_url=base_url)
+
+        def call(i):
+            try:
+                client.get_company_profile(f"LT{i:06d}")
+                return True
+            except CompaniesHouseError:
+                return False
+        return call
+
+    if name == "google":
+        client = GoogleGeocodeClient("load-test", qps=GOOGLE_QPS, base_url=base_url)
+        return lambda i: client.geocode(mock_address(i))[1]
+
+    client = NominatimClient(f"{base_url}/search", max_connections=CLIENT_WORKERS[name])
+
+    def call(i):
+        try:
+            client.search(mock_address(i))
+            return True
+        except Exception:
+            return False
+    return call
+
+
+def run_client(name, base_url, calls):
+    """Make calls calls with the client, CLIENT_WORKERS[name] at a time. Returns its results."""
+    metrics.reset()
+    call = make_call(name, base_url)
+    call_latency = metrics.histogram("load_test.call_seconds")
+
+    def timed_call(i):
+        start = time.monotonic()
+        try:
+            return call(i)
+        finally:
+            call_latency.record(time.monotonic() - start)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=CLIENT_WORKERS[name]) as executor:
+        answered = sum(executor.map(timed_call, range(calls)))
+    seconds = time.monotonic() - start
+
+    prefix = METRIC_PREFIXES[name]
+    request_latency = metrics.histogram(f"{prefix}.latency_seconds")
+    return {
+        "calls": calls,
+        "seconds": round(seconds, 3),
+        "calls_per_second": round(calls / max(seconds, 1e-9), 1),
+        "requests": len(request_latency),
+        "errors": metrics.counter(f"{prefix}.errors"),
+        "rate_limited": metrics.counter(f"{prefix}.rate_limited"),
+        "gave_up": calls - answered,
+        "request_latency": request_latency.summary(),
+        "call_latency": call_latency.summary(),
+        "backoff": metrics.histogram(f"{prefix}.backoff_seconds").summary(),
+    }
+
+
+def format_ms(summary, key):
+    return f"{summary[key] * 1000:.0f}" if summary.get("count") else ""
+
+
+def print_report(scenarios):
+    print("")
+    print(f"{'scenario':<10} {'client':<16} {'calls/s':>8} {'requests':>9} {'errors':>7} {'429s':>6} {'gave up':>8}"
+          f" {'request p50/p95/p99 ms':>23} {'call p50/p95/p99 ms':>21}")
+    for scenario, run in scenarios.items():
+        for name, result in run["clients"].items():
+            request = "/".join(format_ms(result["request_latency"], key) for key in ("p50", "p95", "p99"))
+            call = "/".join(format_ms(result["call_latency"], key) for key in ("p50", "p95", "p99"))
+            print(f"{scenario:<10} {name:<16} {result['calls_per_second']:>8,.1f} {result['requests']:>9}"
+                  f" {result['errors']:>7} {result['rate_limited']:>6} {result['gave_up']:>8} {request:>23} {call:>21}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the API clients against local mock services.")
+    parser.add_argument("--clients", nargs="+", choices=list(CLIENT_WORKERS), default=list(CLIENT_WORKERS))
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--calls", type=int, default=LOAD_TEST_CALLS, help="calls per client in each scenario")
+    parser.add_argument("--port", type=int, default=LOAD_TEST_PORT)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="error", choices=["debug", "info", "warning", "error"],
+                        help="the clients' log level (their retries are logged as warnings)")
+    parser.add_argument("--no-save", action="store_true", help=f"don't add the results to {LOAD_TEST_RESULTS_FILE}")
+    args = parser.parse_args()
+    metrics.configure_logging(args.log_level)
+
+    scenarios = {}
+    for scenario in args.scenarios:
+        settings = BASE_SETTINGS + SCENARIOS[scenario]
+        run = {"settings": settings, "clients": {}}
+        with running_mock_services(settings, args.port, args.seed) as base_url:
+            for name in args.clients:
+                print(f"{scenario}: {name}, {args.calls} calls")
+                run["clients"][name] = run_client(name, base_url, args.calls)
+            run["server"] = requests.get(f"{base_url}/_stats", timeout=10).json()
+        scenarios[scenario] = run
+    print_report(scenarios)
+
+    if not args.no_save:
+        result = {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "machine": platform.node(),
+            "python": platform.python_version(),
+            "mock_defaults": mock_services.make_settings(),
+            "scenarios": scenarios,
+        }
+        with open(LOAD_TEST_RESULTS_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(result) + "\n")
+        print(f"Results added to {LOAD_TEST_RESULTS_FILE}")
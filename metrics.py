@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+Instrumentation shared by the stages: counters, timers, latency histograms and logging.
+
+Each stage calls setup_stage() when it starts. That sets up logging and, when the stage exits,
+writes a JSON metrics report next to its output (<output>.metrics.json) with every counter,
+timer and histogram, the hit rate of every cache, and the stage's time and peak memory.
+
+Per-record messages are logged at debug level, so they're hidden unless asked for - at millions
+of records, printing them costs more than the work. progress() logs a line every
+PROGRESS_INTERVAL seconds instead. Any one kind of debug message (same format string) is
+shown at most LOG_RATE_LIMIT times a second; the rest are counted, and the next one shown
+says how many were left out. So log with %-style arguments, not f-strings. Info messages and
+above (warnings, errors) are never held back.
+
+Every stage takes these options as well as its own:
+    --log-level debug|info|warning|error   (default info)
+    --log-rate-limit N                     (debug messages of a kind per second, 0 for no limit)
+    --metrics FILE                         (where the report goes)
+    --profile cprofile|sample              (profile the stage, see start_profiler)
+
+Counters named "<x>.cache_hits" and "<x>.cache_misses" are reported as x's cache hit rate.
+Everything is thread-safe. Worker processes (pscs_find_non-UK_corporates) have their own
+metrics, so they send their numbers back for the parent to count.
+"""
+import argparse
+import atexit
+import bisect
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+
+LOG_LEVEL = "info"
+LOG_RATE_LIMIT = 5
+PROGRESS_INTERVAL = 10
+# Seconds between the sampling profiler's samples
+SAMPLE_INTERVAL = 0.005
+# Histogram buckets: 100 microseconds upwards, four to each doubling (so within 19% of any value)
+HISTOGRAM_BOUNDS = [1e-4 * 2 ** (i / 4) for i in range(100)]
+
+log = logging.getLogger("pscs")
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far, in MB (None where it can't be found)."""
+    # On Linux, /proc has the process's own peak; ru_maxrss also counts the process it was started from
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def format_rss(rss_mb):
+    return "unknown" if rss_mb is None else f"{rss_mb:,.0f} MB"
+
+
+class Histogram:
+    """
+    Durations (in seconds) counted into log-spaced buckets, so memory stays constant however many
+    are recorded. Percentiles are the upper bound of the bucket they fall in (at most the maximum).
+    """
+
+    def __init__(self):
+        self._buckets = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+        self._count = 0
+        self._total = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        bucket = bisect.bisect_left(HISTOGRAM_BOUNDS, seconds)
+        with self._lock:
+            self._buckets[bucket] += 1
+            self._count += 1
+            self._total += seconds
+            self._max = max(self._max, seconds)
+
+    def __len__(self):
+        return self._count
+
+    def summary(self):
+        with self._lock:
+            buckets, count, total, maximum = list(self._buckets), self._count, self._total, self._max
+        if not count:
+            return {"count": 0}
+
+        def percentile(fraction):
+            rank = fraction * count
+            seen = 0
+            for bucket, n in enumerate(buckets):
+                seen += n
+                if seen >= rank and n:
+                    return min(HISTOGRAM_BOUNDS[bucket], maximum) if bucket < len(HISTOGRAM_BOUNDS) else maximum
+            return maximum
+
+        return {
+            "count": count,
+            "mean": total / count,
+            "p50": percentile(0.50),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": maximum,
+        }
+
+    def format_summary(self, name):
+        summary = self.summary()
+        if not summary["count"]:
+            return f"{name}: no requests"
+        return (f"{name}: {summary['count']} requests, mean {summary['mean'] * 1000:.0f}ms, "
+                f"p50 {summary['p50'] * 1000:.0f}ms, p95 {summary['p95'] * 1000:.0f}ms, "
+                f"p99 {summary['p99'] * 1000:.0f}ms, max {summary['max'] * 1000:.0f}ms")
+
+
+class Metrics:
+    """A stage's counters, timers, histograms and other values. The module functions use METRICS."""
+
+    def __init__(self):
+        self.counters = Counter()
+        self.timers = {}
+        self.histograms = {}
+        self.values = {}
+        self.started = time.time()
+        self._progress = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def counter(self, name):
+        return self.counters[name]
+
+    def histogram(self, name):
+        """The histogram called name, made if it doesn't exist yet."""
+        with self._lock:
+            return self.histograms.setdefault(name, Histogram())
+
+    @contextmanager
+    def timer(self, name):
+        """Time a block: its calls and total seconds are reported under name."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                calls, total = self.timers.get(name, (0, 0.0))
+                self.timers[name] = (calls + 1, total + seconds)
+
+    def reset(self):
+        """Forget everything counted so far (e.g. between the runs of a load test)."""
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+            self.histograms.clear()
+            self.values.clear()
+            self._progress.clear()
+            self.started = time.time()
+
+    def set_value(self, name, value):
+        """Report a JSON-serializable value as it is, e.g. settings or another object's counts."""
+        self.values[name] = value
+
+    def progress(self, name="records", n=1):
+        """Count n more of name, logging how many so far every PROGRESS_INTERVAL seconds."""
+        now = time.monotonic()
+        with self._lock:
+            self.counters[name] += n
+            total = self.counters[name]
+            started, last = self._progress.setdefault(name, (now, now))
+            if now - last < PROGRESS_INTERVAL:
+                return
+            self._progress[name] = (started, now)
+        log.info("%s %s so far (%s/s)", f"{total:,}", name, f"{total / max(now - started, 1e-9):,.0f}")
+
+    def cache_hit_rates(self):
+        rates = {}
+        for name, hits in self.counters.items():
+            if name.endswith(".cache_hits"):
+                cache = name[:-len(".cache_hits")]
+                lookups = hits + self.counters.get(f"{cache}.cache_misses", 0)
+                rates[cache] = round(hits / lookups, 4) if lookups else None
+        return rates
+
+    def report(self):
+        elapsed = time.time() - self.started
+        return {
+            "stage": os.path.basename(sys.argv[0]),
+            "arguments": sys.argv[1:],
+            "started": datetime.fromtimestamp(self.started, timezone.utc).isoformat(timespec="seconds"),
+            "elapsed_seconds": round(elapsed, 3),
+            "cpu_seconds": round(time.process_time(), 3),
+            "peak_rss_mb": peak_rss_mb(),
+            "counters": dict(sorted(self.counters.items())),
+            "cache_hit_rates": self.cache_hit_rates(),
+            "timers": {name: {"calls": calls, "seconds": round(total, 3)}
+                       for name, (calls, total) in sorted(self.timers.items())},
+            "histograms": {name: histogram.summary() for name, histogram in sorted(self.histograms.items())},
+            "values": self.values,
+        }
+
+
+METRICS = Metrics()
+count = METRICS.count
+counter = METRICS.counter
+histogram = METRICS.histogram
+timer = METRICS.timer
+set_value = METRICS.set_value
+progress = METRICS.progress
+reset = METRICS.reset
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most per_second debug messages of each kind (logger and format string) a
+    second. Anything above debug level always goes through.
+    """
+
+    def __init__(self, per_second=LOG_RATE_LIMIT):
+        super().__init__()
+        self.per_second = per_second
+        self._kinds = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.per_second or record.levelno > logging.DEBUG:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            kind = self._kinds.get(key)
+            if kind is None or now - kind[0] >= 1:
+                suppressed = kind[2] if kind else 0
+                self._kinds[key] = [now, 1, 0]
+            elif kind[1] < self.per_second:
+                kind[1] += 1
+                return True
+            else:
+                kind[2] += 1
+                METRICS.count("log.messages_suppressed")
+                return False
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar messages not shown)"
+            record.args = None
+        return True
+
+
+class StageFormatter(logging.Formatter):
+    """Messages as they are, like the print()s they replace, with the level in front of warnings and errors."""
+
+    def format(self, record):
+        message = super().format(record)
+        if record.levelno >= logging.WARNING:
+            message = f"{record.levelname}: {message}"
+        return message
+
+
+class SamplingProfiler:
+    """
+    Samples every thread's stack every SAMPLE_INTERVAL seconds, for stages whose time goes in
+    threads or C calls that cProfile can't see. Writes collapsed stacks ("a;b;c count" lines),
+    which flamegraph.pl and speedscope read.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, path):
+        self._stop.set()
+        self._thread.join()
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, samples in self.stacks.most_common():
+                f.write(f"{stack} {samples}\n")
+        leaves = Counter()
+        for stack, samples in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += samples
+        total = max(sum(leaves.values()), 1)
+        lines = [f"  {100 * samples / total:5.1f}%  {function}" for function, samples in leaves.most_common(15)]
+        log.info("Sampling profile written to %s. Most sampled functions:\n%s", path, "\n".join(lines))
+
+
+def start_profiler(kind, output_base):
+    """
+    Start profiling the stage: "cprofile" (deterministic, main thread only; pstats file
+    <output>.prof) or "sample" (every thread; collapsed stacks in <output>.stacks.txt).
+    Returns a function that stops it and writes the results.
+    """
+    if kind == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def stop():
+            profiler.disable()
+            path = f"{output_base}.prof"
+            profiler.dump_stats(path)
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(15)
+            table = "\n".join(line for line in stream.getvalue().splitlines() if line.strip())
+            log.info("cProfile stats written to %s. Top functions by cumulative time:\n%s", path, table)
+        return stop
+
+    profiler = SamplingProfiler()
+    profiler.start()
+    return lambda: profiler.stop(f"{output_base}.stacks.txt")
+
+
+def configure_logging(level=LOG_LEVEL, rate_limit=LOG_RATE_LIMIT):
+    """Log to stdout at the given level. (Done with the defaults on import, so modules used outside a stage still log.)"""
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(StageFormatter("%(message)s"))
+    handler.addFilter(RateLimitFilter(rate_limit))
+    log.handlers[:] = [handler]
+    log.setLevel(level.upper())
+    log.propagate = False
+
+
+configure_logging()
+
+
+def setup_stage(output_file):
+    """
+    Set up logging and metrics for a stage writing output_file. When the stage exits, the
+    metrics report is written (to --metrics, or output_file plus .metrics.json) and any profile stopped.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--log-level", default=LOG_LEVEL, choices=["debug", "info", "warning", "error"])
+    parser.add_argument("--log-rate-limit", type=int, default=LOG_RATE_LIMIT)
+    parser.add_argument("--metrics", default=f"{output_file}.metrics.json")
+    parser.add_argument("--profile", choices=["cprofile", "sample"])
+    args, _ = parser.parse_known_args()
+
+    configure_logging(args.log_level, args.log_rate_limit)
+    stop_profiler = start_profiler(args.profile, output_file) if args.profile else None
+
+    def finish():
+        if stop_profiler:
+            stop_profiler()
+        write_report(args.metrics)
+
+    atexit.register(finish)
+
+
+def write_report(path):
+    report = METRICS.report()
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+    os.replace(temp_path, path)
+    log.info("Metrics written to %s (%.1fs, peak memory %s)", path, report["elapsed_seconds"],
+             format_rss(report["peak_rss_mb"]))
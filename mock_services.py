@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the Companies House, Google geocoding and Nominatim APIs, so the clients'
+concurrency, retries and rate limiting can be tested and tuned offline (see load_test.py).
+
+    python mock_services.py --set latency_ms=200 --set error_rate=0.02 --set google.qps_limit=20
+
+and point the stages at it with:
+
+    COMPANIES_HOUSE_API_URL=http://127.0.0.1:8798 GOOGLE_GEOCODE_URL=http://127.0.0.1:8798 \
+    NOMINATIM_URL=http://127.0.0.1:8798/search python pscs_add_names
+
+One server answers for all three, by path: /company/<number> (Companies House),
+/maps/api/geocode/json (Google) and /search (Nominatim). /_stats has its counts of what it's
+answered. Each request:
+  - takes a time drawn from a lognormal distribution: median latency_ms, spread latency_sigma
+    (0.5 puts p99 at about three times the median, 1 at about ten times)
+  - fails with probability error_rate: HTTP 5xx (or UNKNOWN_ERROR from Google)
+  - is throttled with probability throttle_rate, as each service does it: 429 with
+    X-Ratelimit-* headers saying to wait throttle_seconds (Companies House), 429 with Retry-After
+    (Google and Nominatim)
+  - is otherwise answered "not found" with probability not_found_rate, or with a made-up
+    result (the same every time for the same company number or address)
+Companies House also enforces its rate limit - rate_limit requests every rate_limit_window
+seconds, between all clients - and reports what's left in the window on every response, as the
+real API does; Google allows at most qps_limit requests a second, answering 429 beyond it.
+(The real Google may answer OVER_QUERY_LIMIT instead, which the client only retries a few
+times, as it usually means the daily quota is used up; the mock doesn't model a quota.)
+--set name=value changes a setting for every service, --set service.name=value for one.
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from collections import Counter, deque
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import synthetic_data
+
+MOCK_PORT = 8798
+GOOGLE_GEOCODE_PATH = "/maps/api/geocode/json"
+
+SERVICES = ["companies_house", "google", "nominatim"]
+DEFAULT_SETTINGS = {"latency_ms": 50, "latency_sigma": 0.5, "error_rate": 0.0, "throttle_rate": 0.0,
+                    "throttle_seconds": 1, "not_found_rate": 0.05}
+# The real services' limits (https://developer-specs.company-information.service.gov.uk/guides/rateLimiting)
+SERVICE_SETTINGS = {
+    "companies_house": {"rate_limit": 600, "rate_limit_window": 300},
+    "google": {"qps_limit": 50},
+    "nominatim": {},
+}
+
+
+def make_settings(overrides=()):
+    """{service: settings}, the defaults changed by "name=value" or "service.name=value" strings."""
+    settings = {service: {**DEFAULT_SETTINGS, **SERVICE_SETTINGS[service]} for service in SERVICES}
+    for override in overrides:
+        name, _, value = override.partition("=")
+        service, _, name = name.rpartition(".")
+        services = [service] if service else SERVICES
+        if not value or any(s not in settings or name not in settings[s] for s in services):
+            raise ValueError(f"unknown setting {override!r}")
+        for s in services:
+            settings[s][name] = float(value)
+    return settings
+
+
+def company_profile(company_number):
+    """A made-up /company/{number} profile, with the fields the stages use."""
+    rng = random.Random(f"company:{company_number}")
+    outward, inward = synthetic_data.postcode_parts(rng.randrange(100_000))
+    incorporated = synthetic_data.SNAPSHOT_AS_OF - timedelta(days=rng.randint(30, 40 * 365))
+    status = rng.choice(["active"] * 90 + ["dissolved"] * 5 + ["liquidation"] * 5)
+    profile = {
+        "company_name": synthetic_data.company_name(rng),
+        "company_number": company_number,
+        "company_status": status,
+        "type": "ltd",
+        "date_of_creation": incorporated.isoformat(),
+        "registered_office_address": {
+            "address_line_1": f"{rng.randint(1, 300)} {rng.choice(synthetic_data.STREETS)}",
+            "locality": rng.choice(synthetic_data.TOWNS),
+            "postal_code": f"{outward} {inward}",
+        },
+        "sic_codes": [sic.split(" - ")[0] for sic in rng.sample(synthetic_data.SIC_TEXTS, rng.randint(1, 2))],
+        "accounts": {
+            "next_accounts": {"overdue": rng.random() < 0.05},
+            "last_accounts": {"type": rng.choice(["full", "micro-entity", "dormant", "small", "group"])},
+        },
+        "registered_office_is_in_dispute": rng.random() < 0.01,
+        "undeliverable_registered_office_address": rng.random() < 0.01,
+    }
+    if status == "dissolved":
+        profile["date_of_cessation"] = (incorporated + timedelta(days=rng.randint(1, 365))).isoformat()
+    return profile
+
+
+def coordinates(rng):
+    """Somewhere in Great Britain."""
+    return round(rng.uniform(50.1, 58.6), 6), round(rng.uniform(-5.6, 1.7), 6)
+
+
+class MockServices:
+    """What the three services answer, and their rate limits' state. Each method returns (status, headers, body)."""
+
+    def __init__(self, settings, seed=None):
+        self.settings = settings
+        self.stats = {service: Counter() for service in SERVICES}
+        self._random = random.Random(seed)
+        self._window_start = time.time()
+        self._window_used = 0
+        self._google_recent = deque()
+        self._lock = threading.Lock()
+
+    def _count(self, service, outcome):
+        with self._lock:
+            self.stats[service][outcome] += 1
+
+    def _begin(self, service):
+        """Wait the request's latency, then roll for an error or throttling. Returns "error", "throttle" or None."""
+        settings = self.settings[service]
+        self._count(service, "requests")
+        if settings["latency_ms"] > 0:
+            time.sleep(self._random.lognormvariate(math.log(settings["latency_ms"] / 1000), settings["latency_sigma"]))
+        roll = self._random.random()
+        if roll < settings["error_rate"]:
+            self._count(service, "errors")
+            return "error"
+        if roll < settings["error_rate"] + settings["throttle_rate"]:
+            self._count(service, "rate_limited")
+            return "throttle"
+        return None
+
+    def _found(self, service, rng):
+        if rng.random() < self.settings[service]["not_found_rate"]:
+            self._count(service, "not_found")
+            return False
+        self._count(service, "ok")
+        return True
+
+    def companies_house(self, company_number):
+        settings = self.settings["companies_house"]
+        outcome = self._begin("companies_house")
+        with self._lock:
+            now = time.time()
+            if now >= self._window_start + settings["rate_limit_window"]:
+                self._window_start, self._window_used = now, 0
+            over_limit = self._window_used >= settings["rate_limit"]
+            if not over_limit:
+                self._window_used += 1
+            remaining = int(settings["rate_limit"] - self._window_used)
+            reset = self._window_start + settings["rate_limit_window"]
+        if outcome == "throttle":
+            # As if another user of the same key had used up the window
+            remaining, reset = 0, time.time() + settings["throttle_seconds"]
+        headers = {"X-Ratelimit-Limit": int(settings["rate_limit"]), "X-Ratelimit-Remain": remaining,
+                   "X-Ratelimit-Reset": math.ceil(reset), "X-Ratelimit-Window": f"{settings['rate_limit_window']:g}s"}
+        if over_limit and outcome != "throttle":
+            self._count("companies_house", "rate_limited")
+        if over_limit or outcome == "throttle":
+            return 429, headers, {"error": "rate limit exceeded"}
+        if outcome == "error":
+            return self._random.choice([500, 502, 503]), headers, {"error": "service unavailable"}
+        if not self._found("companies_house", random.Random(f"found:{company_number}")):
+            return 404, headers, {"errors": [{"error": "company-profile-not-found", "type": "ch:service"}]}
+        return 200, headers, company_profile(company_number)
+
+    def google(self, address):
+        settings = self.settings["google"]
+        outcome = self._begin("google")
+        with self._lock:
+            now = time.monotonic()
+            while self._google_recent and self._google_recent[0] <= now - 1:
+                self._google_recent.popleft()
+            over_limit = len(self._google_recent) >= settings["qps_limit"]
+            if not over_limit:
+                self._google_recent.append(now)
+        if over_limit:
+            self._count("google", "rate_limited")
+        if over_limit or outcome == "throttle":
+            return 429, {"Retry-After": f"{settings['throttle_seconds']:g}"}, {
+                "status": "OVER_QUERY_LIMIT", "results": [],
+                "error_message": "You have exceeded your rate-limit for this API."}
+        if outcome == "error":
+            if self._random.random() < 0.5:
+                return 503, {}, {}
+            return 200, {}, {"status": "UNKNOWN_ERROR", "results": []}
+        rng = random.Random(f"google:{address}")
+        if not self._found("google", rng):
+            return 200, {}, {"status": "ZERO_RESULTS", "results": []}
+        lat, lng = coordinates(rng)
+        return 200, {}, {"status": "OK", "results": [{
+            "formatted_address": address,
+            "geometry": {"location": {"lat": lat, "lng": lng}, "location_type": "APPROXIMATE"},
+            "place_id": f"mock-{rng.getrandbits(48):x}",
+            "types": ["street_address"],
+        }]}
+
+    def nominatim(self, query):
+        settings = self.settings["nominatim"]
+        outcome = self._begin("nominatim")
+        if outcome == "throttle":
+            return 429, {"Retry-After": f"{settings['throttle_seconds']:g}"}, {"error": "Too Many Requests"}
+        if outcome == "error":
+            return self._random.choice([500, 503]), {}, {"error": "Internal Server Error"}
+        rng = random.Random(f"nominatim:{query}")
+        if not self._found("nominatim", rng):
+            return 200, {}, []
+        lat, lon = coordinates(rng)
+        return 200, {}, [{"place_id": rng.getrandbits(32), "lat": str(lat), "lon": str(lon), "display_name": query}]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # Keep-alive, as the clients' connection pools expect. The headers and body are sent
+    # separately, so without TCP_NODELAY each response would wait for the client's delayed ACK.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        services = self.server.services
+        if url.path.startswith("/company/"):
+            status, headers, body = services.companies_house(url.path.split("/")[2])
+        elif url.path == GOOGLE_GEOCODE_PATH:
+            status, headers, body = services.google(query.get("address", [""])[0])
+        elif url.path == "/search":
+            status, headers, body = services.nominatim(query.get("q", [""])[0])
+        elif url.path == "/_stats":
+            status, headers, body = 200, {}, services.stats
+        else:
+            status, headers, body = 404, {}, {"error": "not found"}
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, str(value))
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(settings, host="127.0.0.1", port=MOCK_PORT, seed=None):
+    server = ThreadingHTTPServer((host, port), MockHandler)
+    server.daemon_threads = True
+    server.services = MockServices(settings, seed)
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve stand-ins for the Companies House, Google and Nominatim APIs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=MOCK_PORT)
+    parser.add_argument("--seed", type=int, help="seed for the latencies and failures (answers are always the same)")
+    parser.add_argument("--set", action="append", default=[], metavar="[SERVICE.]NAME=VALUE",
+                        help=f"change a setting: {', '.join(DEFAULT_SETTINGS)}, companies_house.rate_limit, "
+                             "companies_house.rate_limit_window, google.qps_limit")
+    args = parser.parse_args()
+    try:
+        settings = make_settings(args.set)
+    except ValueError as e:
+        parser.error(str(e))
+
+    server = make_server(settings, args.host, args.port, args.seed)
+    base_url = f"http://{args.host}:{args.port}"
+    print(f"Mock services on {base_url}")
+    for service in SERVICES:
+        print(f"  {service}: {', '.join(f'{name}={value:g}' for name, value in settings[service].items())}")
+    print(f"COMPANIES_HOUSE_API_URL={base_url} GOOGLE_GEOCODE_URL={base_url} NOMINATIM_URL={base_url}/search", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Client for a (self-hosted) Nominatim search endpoint.
+
+Requests go through one requests.Session whose connection pool is sized for the number of
+threads using it, so queries reuse keep-alive connections instead of opening a new TCP
+connection each time. Every query's latency is recorded (see metrics.py).
+"""
+import time
+import requests
+from requests.adapters import HTTPAdapter
+import metrics
+
+
+class NominatimClient:
+    def __init__(self, url, max_connections=8, timeout=10):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.latency = metrics.histogram("nominatim.latency_seconds")
+
+    def search(self, address):
+        """
+        Return (lat, lon) of the first Nominatim result for an address, or (None, None) if there
+        are no results. Raises if the request fails.
+        """
+        params = {"q": address, "format": "json"}
+        start = time.monotonic()
+        try:
+            response = self.session.get(self.url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            results = response.json()
+        except Exception:
+            metrics.count("nominatim.errors")
+            raise
+        finally:
+            self.latency.record(time.monotonic() - start)
+        if results:
+            # Use the first result found
+            result = results[0]
+            lat = result.get("lat")
+            lon = result.get("lon")
+            if lat and lon:
+                return lat, lon
+        return None, None
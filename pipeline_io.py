@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Input/output helpers shared by the pipeline stages.
+
+Records pass between the stages as JSON lines, gzip-compressed if the file name ends .gz, so a
+stage can read and write them one at a time rather than loading the whole list.
+
+Every stage keeps its own input_file/output_file defaults, so it can still be run on its own,
+but they can be overridden on the command line - which is how pscs_pipeline.py chains the stages:
+    python pscs_add_names --input a.json --output b.json
+"""
+import argparse
+import gzip
+import json
+import os
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
+# Fast rather than small: most of the gain comes at the lowest levels
+GZIP_LEVEL = 3
+
+
+def stage_paths(input_file, output_file):
+    """
+    Return (input_file, output_file), replaced by --input/--output if given. If the default
+    input_file is a list (a stage with several inputs), --input takes several paths.
+    """
+    parser = argparse.ArgumentParser()
+    if isinstance(input_file, (list, tuple)):
+        parser.add_argument("--input", nargs="+", default=list(input_file))
+    else:
+        parser.add_argument("--input", default=input_file)
+    parser.add_argument("--output", default=output_file)
+    args, _ = parser.parse_known_args()
+    return args.input, args.output
+
+
+def _is_json_array(path):
+    return path.endswith(".json") or path.endswith(".json.gz")
+
+
+def _open_text(path, mode, compressed=None):
+    """Open a file as text, gzip-compressed if its name ends .gz (unless told otherwise)."""
+    if compressed is None:
+        compressed = path.endswith(".gz")
+    if compressed:
+        return gzip.open(path, mode + "t", encoding="utf-8", compresslevel=GZIP_LEVEL)
+    return open(path, mode, encoding="utf-8")
+
+
+def read_records(path):
+    """
+    Yield the records in a stage's input one at a time. Files are JSON lines (one record per line,
+    e.g. .jsonl, .jsonl.gz or the .txt the first stage writes) unless the name ends .json or
+    .json.gz, in which case they're read as one JSON array, as every stage used to write them.
+    """
+    with _open_text(path, "r") as f:
+        if _is_json_array(path):
+            yield from json.load(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json_loads(line)
+
+
+def write_records(path, records):
+    """
+    Write records (any iterable, e.g. a generator) to path as they come, in the format its name
+    implies (see read_records) - a JSON array only for the pipeline's final file.
+    The file is written under a temporary name and renamed when complete. Returns the number written.
+    """
+    temp_path = f"{path}.tmp"
+    count = 0
+    with _open_text(temp_path, "w", compressed=path.endswith(".gz")) as f:
+        if _is_json_array(path):
+            f.write("[")
+            for record in records:
+                f.write(",\n" if count else "\n")
+                f.write(json.dumps(record, ensure_ascii=False))
+                count += 1
+            f.write("\n]\n")
+        else:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False))
+                f.write("\n")
+                count += 1
+    os.replace(temp_path, path)
+    return count
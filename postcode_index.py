@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+UK postcode -> (lat, lon) lookup built from the Ordnance Survey Code-Point Open CSVs.
+
+The first time it is used, the CSVs are read, every postcode's eastings/northings are converted
+to latitude/longitude, and the result is saved as a compact binary hash table. Later runs
+memory-map that file, so opening the index is almost instant and each lookup reads a few bytes.
+The index is rebuilt automatically if any of the CSVs is newer than it.
+
+File layout (all little-endian):
+  header:  magic (8 bytes), number of records (uint32), number of slots (uint32, a power of two)
+  records: number of records x (postcode (7 bytes, no spaces, NUL padded), lat (double), lon (double))
+  slots:   number of slots x uint32 - record number + 1, or 0 for an empty slot (linear probing)
+"""
+import csv
+import glob
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from functools import lru_cache
+import numpy as np
+from pyproj import Transformer
+import metrics
+from metrics import log
+
+CODEPOINT_CSV_FOLDER = "codepo_gb/Data/CSV"
+POSTCODE_INDEX_FILE = "codepo_gb/postcode_index.bin"
+
+MAGIC = b"PCIDX001"
+HEADER = struct.Struct("<8sII")
+RECORD = struct.Struct("<7sdd")
+SLOT = struct.Struct("<I")
+KEY_LENGTH = 7
+
+
+def normalize_postcode(postcode):
+    """Upper case with all whitespace removed, so "e1 6an" and "E1  6AN" find the same entry."""
+    return "".join(postcode.split()).upper()
+
+
+def _slot_for(key, slot_mask):
+    # crc32 rather than hash() because str hashes change between Python runs
+    return zlib.crc32(key) & slot_mask
+
+
+@lru_cache(maxsize=None)
+def get_transformer():
+    """British National Grid -> WGS84. Creating a Transformer is slow, so there is only ever one."""
+    return Transformer.from_crs("EPSG:27700", "EPSG:4326", always_xy=True)
+
+
+def convert_bng_batch(eastings, northings):
+    """Convert arrays of eastings/northings to arrays of (lats, lons) in one vectorized call."""
+    lons, lats = get_transformer().transform(np.asarray(eastings, dtype=np.float64),
+                                             np.asarray(northings, dtype=np.float64))
+    return lats, lons
+
+
+def read_codepoint_csvs(csv_folder=CODEPOINT_CSV_FOLDER):
+    """
+    Read every Code-Point Open CSV in csv_folder. The CSVs have no header row; the columns are
+    postcode, positional quality indicator, eastings, northings, then various admin codes.
+    Returns (postcodes, eastings, northings) lists, keeping the first row for each postcode.
+    """
+    postcodes, eastings, northings = [], [], []
+    seen = set()
+    for csv_file in sorted(glob.glob(os.path.join(csv_folder, "*.csv"))):
+        try:
+            with open(csv_file, newline="", encoding="utf-8") as f:
+                for row in csv.reader(f):
+                    if len(row) < 4:
+                        continue
+                    key = normalize_postcode(row[0])
+                    if not key or len(key) > KEY_LENGTH or key in seen:
+                        continue
+                    try:
+                        easting, northing = float(row[2]), float(row[3])
+                    except ValueError:
+                        continue
+                    seen.add(key)
+                    postcodes.append(key)
+                    eastings.append(easting)
+                    northings.append(northing)
+        except Exception as e:
+            log.warning("Error reading %s: %s", csv_file, e)
+    return postcodes, eastings, northings
+
+
+def build_postcode_index(csv_folder=CODEPOINT_CSV_FOLDER, index_file=POSTCODE_INDEX_FILE):
+    """Convert the Code-Point CSVs to lat/lon and write them out as an index file."""
+    log.info("Building postcode index %s from %s", index_file, csv_folder)
+    postcodes, eastings, northings = read_codepoint_csvs(csv_folder)
+
+    lats, lons = convert_bng_batch(eastings, northings)
+
+    n_slots = 1
+    while n_slots < 2 * len(postcodes):
+        n_slots *= 2
+    slot_mask = n_slots - 1
+    slots = array("I", bytes(SLOT.size * n_slots))
+
+    records = bytearray(RECORD.size * len(postcodes))
+    for i, postcode in enumerate(postcodes):
+        key = postcode.encode("ascii")
+        RECORD.pack_into(records, i * RECORD.size, key, float(lats[i]), float(lons[i]))
+        slot = _slot_for(key, slot_mask)
+        while slots[slot]:
+            slot = (slot + 1) & slot_mask
+        slots[slot] = i + 1
+
+    # Write to a temporary file first so an interrupted build never leaves a truncated index.
+    os.makedirs(os.path.dirname(index_file) or ".", exist_ok=True)
+    temp_file = index_file + ".tmp"
+    with open(temp_file, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(postcodes), n_slots))
+        f.write(records)
+        if sys.byteorder == "big":
+            slots.byteswap()
+        f.write(slots.tobytes())
+    os.replace(temp_file, index_file)
+    metrics.count("postcode_index.postcodes_indexed", len(postcodes))
+    log.info("Indexed %d postcodes", len(postcodes))
+
+
+def index_is_stale(csv_folder=CODEPOINT_CSV_FOLDER, index_file=POSTCODE_INDEX_FILE):
+    if not os.path.exists(index_file):
+        return True
+    index_mtime = os.path.getmtime(index_file)
+    return any(os.path.getmtime(f) > index_mtime for f in glob.glob(os.path.join(csv_folder, "*.csv")))
+
+
+class PostcodeIndex:
+    """A memory-mapped postcode index file. Use load_postcode_index() to get one."""
+
+    def __init__(self, index_file=POSTCODE_INDEX_FILE):
+        with open(index_file, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.n_records, self.n_slots = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{index_file} is not a postcode index")
+        self._slot_mask = self.n_slots - 1
+        self._records_offset = HEADER.size
+        self._slots_offset = HEADER.size + self.n_records * RECORD.size
+
+    def __len__(self):
+        return self.n_records
+
+    def lookup(self, postcode):
+        """Return (lat, lon) for a postcode, or (None, None) if it isn't in the index."""
+        if not postcode:
+            return None, None
+        key = normalize_postcode(postcode).encode("ascii", errors="replace")
+        if len(key) > KEY_LENGTH:
+            return None, None
+        padded_key = key.ljust(KEY_LENGTH, b"\0")
+
+        slot = _slot_for(key, self._slot_mask)
+        while True:
+            (entry,) = SLOT.unpack_from(self._map, self._slots_offset + slot * SLOT.size)
+            if not entry:
+                return None, None
+            record_key, lat, lon = RECORD.unpack_from(self._map, self._records_offset + (entry - 1) * RECORD.size)
+            if record_key == padded_key:
+                return lat, lon
+            slot = (slot + 1) & self._slot_mask
+
+
+def load_postcode_index(csv_folder=CODEPOINT_CSV_FOLDER, index_file=POSTCODE_INDEX_FILE):
+    """Open the postcode index, building it first if it's missing or out of date."""
+    if index_is_stale(csv_folder, index_file):
+        with metrics.timer("build_postcode_index"):
+            build_postcode_index(csv_folder, index_file)
+    return PostcodeIndex(index_file)
+
+
+if __name__ == "__main__":
+    build_postcode_index()
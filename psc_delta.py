@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Delta mode: carry results forward from last month's run for PSC statements that haven't changed.
+
+A PSC statement is identified by its company number plus its links.self, and has changed if its
+etag has. A paid stage (geocoding, the Companies House API) given its own input and output from
+the previous run (--previous-input / --previous-output) reuses the previous output record for
+every unchanged statement, drops again any unchanged statement it dropped last time, and only
+does the work for statements that are new or changed.
+
+An unchanged etag only means the PSC statement is the same, not the company. find_geodata's
+results depend only on the statement, so it reuses its previous output records as they are.
+The Companies House stages (add_names, add_uk_addresses) keep only the company details they
+added last time, and then replace whatever of them the current bulk snapshot has - name,
+status, dates, accounts type and overdue, registered office (add_names also drops a company
+that is now liquidated). The flags only the API has (registered office in dispute, undeliverable
+registered office address) aren't refreshed: they stay as fetched when the statement was last
+new or changed, so a full run (without --previous-run) now and then is needed to update them.
+
+To see how two snapshots' non-UK corporate PSCs differ:
+    python psc_delta.py old/non-UK_corporate_pscs.txt non-UK_corporate_pscs.txt
+"""
+import argparse
+import sys
+from pipeline_io import read_records
+from metrics import log
+
+
+def psc_key(record):
+    """(company number, links.self) - or None if the record has no links.self."""
+    data = record.get("data") or {}
+    self_link = (data.get("links") or {}).get("self")
+    if not self_link:
+        return None
+    return record.get("company_number"), self_link
+
+
+def psc_etag(record):
+    return (record.get("data") or {}).get("etag")
+
+
+def previous_run_paths():
+    """The --previous-input and --previous-output paths given on the command line, or (None, None)."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--previous-input")
+    parser.add_argument("--previous-output")
+    args, _ = parser.parse_known_args()
+    return args.previous_input, args.previous_output
+
+
+class PreviousResults:
+    """A stage's input and output from the previous run, indexed by PSC statement."""
+
+    def __init__(self, previous_input, previous_output):
+        self.outputs = {}
+        for record in read_records(previous_output):
+            key = psc_key(record)
+            if key is not None:
+                self.outputs[key] = (psc_etag(record), record)
+        # What went in last time, to tell statements the stage dropped from ones it never saw
+        self.inputs = {}
+        for record in read_records(previous_input):
+            key = psc_key(record)
+            if key is not None:
+                self.inputs[key] = psc_etag(record)
+        self.counts = {"carried_forward": 0, "dropped_again": 0, "new_or_changed": 0}
+
+    def lookup(self, record):
+        """
+        Return ("unchanged", the previous output record), ("dropped", None) if the stage dropped
+        this unchanged statement last time, or (None, None) if it's new or changed.
+        Doesn't count anything (see count).
+        """
+        key = psc_key(record)
+        etag = psc_etag(record)
+        if key is None or etag is None or self.inputs.get(key) != etag:
+            return None, None
+        previous = self.outputs.get(key)
+        if previous is None:
+            return "dropped", None
+        if previous[0] != etag:
+            return None, None
+        return "unchanged", previous[1]
+
+    def count(self, status):
+        self.counts[{"unchanged": "carried_forward", "dropped": "dropped_again", None: "new_or_changed"}[status]] += 1
+
+    def format_stats(self):
+        counts = self.counts
+        return (f"Delta: {counts['carried_forward']} records carried forward from the previous run, "
+                f"{counts['dropped_again']} dropped again, {counts['new_or_changed']} new or changed")
+
+
+def load_previous_results():
+    """PreviousResults from the command line's --previous-input/--previous-output, or None if not given."""
+    previous_input, previous_output = previous_run_paths()
+    if not (previous_input and previous_output):
+        return None
+    log.info("Delta mode: reusing results for unchanged PSCs from %s", previous_output)
+    return PreviousResults(previous_input, previous_output)
+
+
+def diff_snapshots(old_path, new_path):
+    """Count the PSC statements added, changed, removed and unchanged between two files of PSC records."""
+    old = {psc_key(record): psc_etag(record) for record in read_records(old_path)}
+    counts = {"added": 0, "changed": 0, "unchanged": 0}
+    seen = set()
+    for record in read_records(new_path):
+        key = psc_key(record)
+        seen.add(key)
+        if key not in old:
+            counts["added"] += 1
+        elif old[key] != psc_etag(record):
+            counts["changed"] += 1
+        else:
+            counts["unchanged"] += 1
+    counts["removed"] = len(set(old) - seen)
+    return counts
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python psc_delta.py OLD_PSCS NEW_PSCS")
+        sys.exit(1)
+    counts = diff_snapshots(sys.argv[1], sys.argv[2])
+    total = sum(counts[k] for k in ("added", "changed", "unchanged"))
+    print(f"{total} PSCs: {counts['added']} added, {counts['changed']} changed, "
+          f"{counts['unchanged']} unchanged ({counts['unchanged'] / max(total, 1):.1%}); {counts['removed']} removed")
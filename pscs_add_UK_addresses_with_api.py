@@ -1,21 +1,38 @@
 #!/usr/bin/env python3
 import json
-import time
-import requests
 from companies_house_settings import companies_house_api_key
-from pyproj import Transformer
-import glob
-import pandas as pd
-import os
+from companies_house_client import CompaniesHouseClient
+from company_profile_cache import CompanyProfileCache
+from company_snapshot import load_company_snapshot, plan_enrichment, snapshot_fields
+from postcode_index import load_postcode_index
+from checkpoint import ProgressLog
+from pipeline_io import stage_paths, read_records, write_records
+from psc_delta import load_previous_results
+import metrics
+from metrics import log
 
 DEBUG_LIMIT = 1e9
 
+# Number of profile requests in flight at once (the client keeps them within the API rate limit)
+CH_WORKERS = 4
+# Only use profiles already in the on-disk cache (see company_profile_cache.py); make no API calls
+CH_OFFLINE = False
+# Take what we can from the bulk snapshot and only ask the API for the rest (see company_snapshot.py)
+USE_SNAPSHOT = True
+
 # Input and output file paths
-input_file = "pscs_list_of_non-uk_corp_pscs_v3-with-postcode-and-address-lookup.json"
-output_file = "pscs_list_of_non-uk_corp_pscs_v3.3-with-postcode-and-address-lookup-with-api.json"
+input_file = "pscs_list_of_non-uk_corp_pscs_v3-with-postcode-and-address-lookup.jsonl"
+output_file = "pscs_list_of_non-uk_corp_pscs_v3.3-with-postcode-and-address-lookup-with-api.jsonl"
+input_file, output_file = stage_paths(input_file, output_file)
+metrics.setup_stage(output_file)
 
 SIC_CODE_LOOKUP_FILE = "sic_codes.json"
 
+# The company_details fields this stage adds
+COMPANY_DETAILS_FIELDS = ["accounts_overdue", "registered_office_is_in_dispute", "accounts_type",
+                          "undeliverable_registered_office_address", "dissolution_date", "incorporation_date",
+                          "company_status", "SICs", "postcode", "address"]
+
 def load_list_of_sic_codes():
     """Load the SIC code lookup file into a dictionary."""
     with open(SIC_CODE_LOOKUP_FILE, 'r') as f:
@@ -31,29 +48,10 @@ def create_sic_code_text(sic_codes):
     return ', '.join(f"{code} {sic_code_lookup.get(code, 'Unknown')}" for code in sic_codes)
 
 
-def get_company_details_from_api(company_number, company_details):
-    
-    url = f"https://api.company-information.service.gov.uk/company/{company_number}"
-    while True:
-                
-        try:
-            response = requests.get(url, auth=(companies_house_api_key, ''))
-            
-            if response.status_code == 200:
-                break
-            
-            elif response.status_code == 404:
-                # print(f"Can't find company {company_name}: HTTP {response.status_code}...")
-                return company_details
-            else:
-                print(f"Error fetching details for company {company_name}: HTTP {response.status_code}. Retrying in 10 seconds...")
-                time.sleep(10)
-                
-        except requests.RequestException as e:
-            print(f"Error fetching details for company {company_name}: {e}. Retrying in 10 seconds...")
-            time.sleep(10)
-            
-    profile = response.json()
+def add_company_details_from_profile(company_details, profile):
+    """Copy the fields we use from an API company profile into company_details."""
+    if not profile:
+        return company_details
     
     company_details["accounts_overdue"] = profile.get("accounts", {}).get("next_accounts", {}).get("overdue", False)
     company_details["registered_office_is_in_dispute"] = profile.get("registered_office_is_in_dispute", False)
@@ -69,171 +67,138 @@ def get_company_details_from_api(company_number, company_details):
     return company_details      
 
 
-# Helper function to convert eastings/northings to latitude/longitude.
-def convert_bng(easting, northing):
-    transformer = Transformer.from_crs("EPSG:27700", "EPSG:4326", always_xy=True)
-    lon, lat = transformer.transform(easting, northing)
-    return lat, lon
-
-def load_all_postcode_csvs(csv_folder='codepo_gb/Data/CSV'):
-    """
-    Loads all CSV files from the specified folder into a single DataFrame.
-    Assumes each CSV file:
-      - Has no header.
-      - Uses comma as the delimiter.
-      - Follows the column order defined in COLUMN_NAMES.
-    
-    Returns:
-      pandas.DataFrame: DataFrame containing data from all CSV files.
-    """
-    
-    print("\nLoading all postcode CSVs")
-
-    # Define the column names as per the ordnance survey CSV specification.
-    COLUMN_NAMES = [
-        "Postcode",
-        "Positional_quality_indicator",
-        "Eastings",
-        "Northings",
-        "Country_code",
-        "NHS_regional_HA_code",
-        "NHS_HA_code",
-        "Admin_county_code",
-        "Admin_district_code",
-        "Admin_ward_code"
-    ]
-    # Find all CSV files in the folder.
-    csv_files = glob.glob(os.path.join(csv_folder, '*.csv'))
-    dataframes = []
-    
-    for csv_file in csv_files:
-        try:
-            df = pd.read_csv(csv_file, delimiter=',', header=None, names=COLUMN_NAMES)
-            dataframes.append(df)
-        except Exception as e:
-            print(f"Error reading {csv_file}: {e}")
-    
-    if dataframes:
-        # Concatenate all dataframes.
-        all_data = pd.concat(dataframes, ignore_index=True)
-        # Normalize the 'Postcode' column for consistent lookups.
-        all_data['Postcode'] = all_data['Postcode'].astype(str).str.strip().str.upper()
-        return all_data
-    else:
-        return pd.DataFrame(columns=COLUMN_NAMES)
-
-
-
-def convert_uk_postcode_to_latlon(postcode):
-    """
-    Given a UK postcode, look up the eastings and northings from the preloaded DataFrame
-    and convert them to latitude and longitude.
-    
-    Parameters:
-      postcode (str): The UK postcode (e.g. "AB1 5XS").
-    
-    Returns:
-      tuple: (lat, lon) if found, else None.
-    """
-    if postcode is None:
-        return None, None
-    
-    # Normalize the input postcode.
-    postcode = postcode.strip().upper()
-    
-    # Filter the DataFrame for the matching postcode.
-    match = POSTCODE_DATA[POSTCODE_DATA['Postcode'] == postcode]
-    if match.empty:
-        print(f"Postcode {postcode} not found in data.")
-        return None, None
-    
-    # Use the first matching row.
-    row = match.iloc[0]
-    
-    # Extract eastings and northings and ensure they are numeric.
-    try:
-        eastings = float(row['Eastings'])
-        northings = float(row['Northings'])
-    except Exception as e: 
-        print(f"Error converting eastings/northings for {postcode}: {e}")
-        return None, None
-
-    # Convert to latitude/longitude.
-    lat, lon = convert_bng(eastings, northings)
-    return lat, lon
-
-
-print("Loading SIC codes")
+log.info("Loading SIC codes")
 sic_code_lookup = load_list_of_sic_codes()
 
       
-POSTCODE_DATA = load_all_postcode_csvs()
-
-print("Loading psc json")
-with open(input_file, "r", encoding="utf-8") as infile:
-    records = json.load(infile)
+POSTCODE_INDEX = load_postcode_index()
 
+# In delta mode, records unchanged since the previous run keep the details fetched for them,
+# refreshed with what the snapshot has now (see psc_delta.py)
+previous = load_previous_results()
 
-success = 0
-success_and_geo = 0
-already = 0
-fail = 0
-
-new_records = []
-for idx, record in enumerate(records):
-    
+# Get the details of every company we don't have an address for: from the snapshot where it
+# has all we need, otherwise by fetching its profile, several at a time.
+company_numbers, carried_numbers = [], []
+for idx, record in enumerate(read_records(input_file)):
     if DEBUG_LIMIT and idx > DEBUG_LIMIT:
-        print("DEBUG LIMIT REACHED")
         break
-    
-    company_details = record.get("company_details", {})
     company_number = record.get("company_number")
-    company_name = company_details.get("company_name")
-    if not company_number:
-        print(f"ERROR: can't find company number for {company_name}")
-        print(record)
-        exit(1)
-        
-    address = record.get("company_details", {}).get("address")
-        
-    if address:
-        print(f"{idx}: {company_number} already have address")
-        already += 1
-    
+    if not company_number or record.get("company_details", {}).get("address"):
+        continue
+    if previous and previous.lookup(record)[0] == "unchanged":
+        carried_numbers.append(company_number)
     else:
-        
-        company_details = get_company_details_from_api(company_number, company_details)
-        
-        postcode = company_details.get("postcode")
-
-        if postcode:
-            lat, lon = convert_uk_postcode_to_latlon(postcode)
-            if lat and lon:
-                company_details["lat"] = lat
-                company_details["lon"] = lon
-                print(f"{idx}: {company_number} ({company_name}) geolocated to {lat, lon}")
-                success_and_geo += 1
-            else:
-                print(f"{idx}: {company_number} ({company_name}) can't geolocate")
-                success += 1
-                
-        elif address:
-            print(f"{idx}: {company_number} ({company_name}) no postcode")
-            success += 1
+        company_numbers.append(company_number)
+company_numbers = list(dict.fromkeys(company_numbers))
+if USE_SNAPSHOT:
+    snapshot = load_company_snapshot(company_numbers + carried_numbers)
+    from_snapshot, to_fetch = plan_enrichment(company_numbers, snapshot, COMPANY_DETAILS_FIELDS)
+    refreshed = snapshot_fields(carried_numbers, snapshot, COMPANY_DETAILS_FIELDS)
+    del snapshot
+else:
+    from_snapshot, to_fetch, refreshed = {}, company_numbers, {}
+
+# Each fetched company's details go in the progress log as they come, so if the run is
+# interrupted the next one carries on from where it stopped (see checkpoint.py)
+progress = ProgressLog(output_file, input_file)
+fetched = dict(progress.items())
+to_fetch = [company_number for company_number in to_fetch if company_number not in progress]
+
+client = CompaniesHouseClient(companies_house_api_key, max_workers=CH_WORKERS,
+                              cache=CompanyProfileCache(), offline=CH_OFFLINE)
+log.info("Fetching %d company profiles", len(to_fetch))
+try:
+    for company_number, profile in client.get_company_profiles(to_fetch):
+        metrics.progress("profiles fetched")
+        fetched[company_number] = add_company_details_from_profile({}, profile) if profile else None
+        # (Offline, no profile only means it isn't cached, so don't remember it as unknown)
+        if profile or not CH_OFFLINE:
+            progress.record(company_number, fetched[company_number])
+finally:
+    progress.close()
+
+
+def carried_forward_details(company_number, previous_record):
+    """The details added to an unchanged record last run, with the snapshot's fields now."""
+    details = {field: value for field, value in (previous_record.get("company_details") or {}).items()
+               if field in COMPANY_DETAILS_FIELDS}
+    details.update(refreshed.get(company_number, {}))
+    return details
+
+
+def records_with_addresses():
+    """The records, adding the address (and what else we can) of each company that hasn't one."""
+    for idx, record in enumerate(read_records(input_file)):
+
+        if DEBUG_LIMIT and idx > DEBUG_LIMIT:
+            log.info("DEBUG LIMIT REACHED")
+            return
+        metrics.progress("records")
+
+        status = previous_record = None
+        if previous:
+            status, previous_record = previous.lookup(record)
+            previous.count(status)
+
+        company_details = record.get("company_details", {})
+        company_number = record.get("company_number")
+        company_name = company_details.get("company_name")
+        if not company_number:
+            log.error("can't find company number for %s: %s", company_name, record)
+            exit(1)
+
+        address = record.get("company_details", {}).get("address")
+
+        if address:
+            log.debug("%d: %s already have address", idx, company_number)
+            metrics.count("records.already_had_address")
+
         else:
-            print(f"{idx}: {company_number} ({company_name}) no information obtained")
-            fail += 1
-    
-    new_records.append(record)
 
-# Export the new records to the output file.
-with open(output_file, "w", encoding="utf-8") as outfile:
-    json.dump(new_records, outfile, indent=2)
+            if status == "unchanged":
+                company_details.update(carried_forward_details(company_number, previous_record))
+            elif company_number in from_snapshot:
+                company_details.update(from_snapshot[company_number])
+            elif fetched.get(company_number):
+                company_details.update(fetched[company_number])
+
+            postcode = company_details.get("postcode")
+
+            if postcode:
+                lat, lon = POSTCODE_INDEX.lookup(postcode)
+                if lat and lon:
+                    company_details["lat"] = lat
+                    company_details["lon"] = lon
+                    log.debug("%d: %s (%s) geolocated to %s", idx, company_number, company_name, (lat, lon))
+                    metrics.count("records.added_and_geolocated")
+                else:
+                    log.debug("%d: %s (%s) can't geolocate %s", idx, company_number, company_name, postcode)
+                    metrics.count("records.added_not_geolocated")
+
+            elif address:
+                log.debug("%d: %s (%s) no postcode", idx, company_number, company_name)
+                metrics.count("records.added_not_geolocated")
+            else:
+                log.debug("%d: %s (%s) no information obtained", idx, company_number, company_name)
+                metrics.count("records.failed")
+
+        yield record
+
+
+# Export the new records to the output file as they're made.
+with metrics.timer("write_output"):
+    exported = write_records(output_file, records_with_addresses())
+progress.finish()
 
-print(f"Exported {len(new_records)} records to {output_file}")
+log.info("Exported %d records to %s", exported, output_file)
 
-print(f"{success_and_geo} added all data")
-print(f"{success} added but couldn't geolocate")
-print(f"{already} already had address")
-print(f"{fail} failed")
+log.info("%d added all data", metrics.counter("records.added_and_geolocated"))
+log.info("%d added but couldn't geolocate", metrics.counter("records.added_not_geolocated"))
+log.info("%d already had address", metrics.counter("records.already_had_address"))
+log.info("%d failed", metrics.counter("records.failed"))
+log.info("%s", client.format_stats())
+if previous:
+    log.info("%s", previous.format_stats())
+    metrics.set_value("delta", previous.counts)
 
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Writes the data the map (pscs_map_v3.js) loads: only the fields it uses, worked out in advance.
+
+The pipeline's final json has every PSC field and is read by the browser a record at a time.
+This is columnar instead - one array per field, so names aren't repeated per record - with:
+  - each marker's category (its colour on the map) and its warnings as bit flags
+  - the values that repeat (company status, accounts type, SIC codes, the PSC's country and
+    the category) as indexes into a table of the distinct values
+  - the PSC's name in capitals, its address joined up and the UK address in title case, as the
+    map showed them
+  - coordinates to COORDINATE_DECIMALS decimal places (about a metre)
+
+The json is also written pre-compressed, as .json.gz and (if the brotli module is installed)
+.json.br, for a web server to send as they are. The map fetches the .gz and decompresses it
+itself where the server won't; the plain .json is the fallback.
+"""
+import gzip
+import json
+import os
+from pipeline_io import stage_paths, read_records
+import metrics
+from metrics import log
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Input and output file paths
+input_file = "pscs_list_of_non-uk_corp_pscs_v3.5.json"
+output_file = "pscs_map_v3_data.json"
+input_file, output_file = stage_paths(input_file, output_file)
+metrics.setup_stage(output_file)
+
+# Bumped when the layout changes, so the map can tell it's been given the wrong one
+WEB_FORMAT_VERSION = 1
+COORDINATE_DECIMALS = 5
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# In the order the map's legend has them
+CATEGORIES = ["green", "orange", "red", "grey", "black"]
+WARNING_FLAGS = {"accounts_overdue": 1, "registered_office_is_in_dispute": 2,
+                 "undeliverable_registered_office_address": 4}
+PSC_ADDRESS_FIELDS = ["premises", "address_line_1", "locality", "region"]
+INTERNED_COLUMNS = ["category", "company_status", "accounts_type", "SICs", "psc_country"]
+
+
+def marker_category(company_details, psc_data):
+    """
+    The marker's colour: black if the company isn't active, grey if the PSC has ceased to be one,
+    red if there's a warning, orange if the company is dormant, otherwise green.
+    """
+    if (company_details.get("company_status") or "") != "Active":
+        return "black"
+    if psc_data.get("ceased_on"):
+        return "grey"
+    if any(company_details.get(flag) for flag in WARNING_FLAGS):
+        return "red"
+    if company_details.get("accounts_type") == "dormant":
+        return "orange"
+    return "green"
+
+
+def title_case(text):
+    """As the map shows UK addresses: each comma-separated part trimmed, each word capitalised."""
+    return ", ".join(" ".join(word[:1].upper() + word[1:].lower() for word in part.strip().split(" "))
+                     for part in text.split(","))
+
+
+def coordinate(value):
+    """A coordinate rounded for the map, or None. (Nominatim's come as strings.)"""
+    try:
+        return round(float(value), COORDINATE_DECIMALS)
+    except (TypeError, ValueError):
+        return None
+
+
+class InternedColumn:
+    """A column of indexes into a table of the distinct values, in the order first seen."""
+
+    def __init__(self, values=()):
+        self.table = list(values)
+        self.index = {value: i for i, value in enumerate(self.table)}
+        self.column = []
+
+    def append(self, value):
+        i = self.index.get(value)
+        if i is None:
+            i = self.index[value] = len(self.table)
+            self.table.append(value)
+        self.column.append(i)
+
+
+def write_file(path, data):
+    """Write bytes under a temporary name and rename when complete, as write_records does."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+
+columns = {name: [] for name in ["company_number", "company_name", "psc_name", "psc_address", "ceased_on",
+                                 "incorporation_date", "uk_address", "warnings",
+                                 "psc_lat", "psc_lon", "uk_lat", "uk_lon"]}
+interned = {name: InternedColumn(CATEGORIES if name == "category" else ()) for name in INTERNED_COLUMNS}
+
+for record in read_records(input_file):
+    metrics.progress("records")
+    company_details = record.get("company_details") or {}
+    psc_data = record.get("data") or {}
+    psc_lat, psc_lon = coordinate(record.get("latitude")), coordinate(record.get("longitude"))
+    uk_lat, uk_lon = coordinate(company_details.get("lat")), coordinate(company_details.get("lon"))
+    # The map shows a record in PSC mode if it has the PSC's coordinates, and in UK mode if
+    # it has either
+    if (psc_lat is None or psc_lon is None) and (uk_lat is None or uk_lon is None):
+        metrics.count("records.not_geolocated")
+        continue
+
+    address = psc_data.get("address") or {}
+    warnings = sum(bit for flag, bit in WARNING_FLAGS.items() if company_details.get(flag))
+    columns["company_number"].append(record.get("company_number") or "")
+    columns["company_name"].append(company_details.get("company_name") or "")
+    columns["psc_name"].append((psc_data.get("name") or "").upper())
+    columns["psc_address"].append(", ".join(address[key] for key in PSC_ADDRESS_FIELDS if address.get(key)))
+    columns["ceased_on"].append(psc_data.get("ceased_on") or "")
+    columns["incorporation_date"].append(company_details.get("incorporation_date") or "")
+    columns["uk_address"].append(title_case(company_details["address"]) if company_details.get("address") else "")
+    columns["warnings"].append(warnings)
+    columns["psc_lat"].append(psc_lat)
+    columns["psc_lon"].append(psc_lon)
+    columns["uk_lat"].append(uk_lat)
+    columns["uk_lon"].append(uk_lon)
+    category = marker_category(company_details, psc_data)
+    interned["category"].append(category)
+    interned["company_status"].append(company_details.get("company_status") or "")
+    interned["accounts_type"].append(company_details.get("accounts_type") or "")
+    interned["SICs"].append(company_details.get("SICs") or "")
+    interned["psc_country"].append(address.get("country") or "")
+    metrics.count(f"markers.{category}")
+
+payload = {
+    "version": WEB_FORMAT_VERSION,
+    "count": len(columns["company_number"]),
+    "columns": {**columns, **{name: column.column for name, column in interned.items()}},
+    "tables": {name: column.table for name, column in interned.items()},
+}
+
+
+with metrics.timer("write_output"):
+    data = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    write_file(output_file, data)
+    sizes = {"json": len(data)}
+    gzipped = gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+    write_file(f"{output_file}.gz", gzipped)
+    sizes["gzip"] = len(gzipped)
+    if brotli is not None:
+        compressed = brotli.compress(data, quality=BROTLI_QUALITY)
+        write_file(f"{output_file}.br", compressed)
+        sizes["brotli"] = len(compressed)
+    else:
+        log.info("brotli isn't installed (pip install brotli), so no .br file")
+
+input_size = os.path.getsize(input_file)
+metrics.set_value("bytes", {"input": input_size, **sizes})
+log.info("Exported %d markers to %s", payload["count"], output_file)
+log.info("%s bytes from %s bytes (%s)", f"{sizes['json']:,}", f"{input_size:,}",
+         ", ".join(f"{kind} {size:,}" for kind, size in sizes.items() if kind != "json"))
@@ -1,7 +1,13 @@
 #!/usr/bin/env python3
-import json
-import time
-import requests
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from nominatim_client import NominatimClient
+from geocode_cache import GeocodeCache
+from address_variants import generate_address_variants
+from pipeline_io import stage_paths, read_records, write_records
+import metrics
+from metrics import log
 
 
 """
@@ -18,174 +24,137 @@ docker run -it \
 """
 
 # Input and output file paths
-input_file = "pscs_list_of_non-uk_corp_pscs_v3.3-with-postcode-and-address-lookup-with-api.json"
-output_file = "pscs_list_of_non-uk_corp_pscs_v3.4-additional-addresses.json"
+input_file = "pscs_list_of_non-uk_corp_pscs_v3.3-with-postcode-and-address-lookup-with-api.jsonl"
+output_file = "pscs_list_of_non-uk_corp_pscs_v3.4-additional-addresses.jsonl"
+input_file, output_file = stage_paths(input_file, output_file)
+metrics.setup_stage(output_file)
 
 DEBUG_LIMIT = None
-NOMINATIM_URL = "http://192.168.1.53:8080/search"
-
-def query_nominatim(address, timeout=10):
-    params = {"q": address, "format": "json"}
-    try:
-        response = requests.get(NOMINATIM_URL, params=params, timeout=timeout)
-        response.raise_for_status()
-        results = response.json()
-        if results:
-            # Use the first result found
-            result = results[0]
-            lat = result.get("lat")
-            lon = result.get("lon")
-            if lat and lon:
-                return lat, lon
-    except Exception as e:
-        print(f"Error querying Nominatim for address '{address}': {e}")
-    return None, None
-
-def join_address_parts(parts):
-    # Join non-empty, stripped parts with a comma and a space.
-    filtered = [p.strip() for p in parts if p.strip()]
-    return ", ".join(filtered) if filtered else ""
+# (NOMINATIM_URL in the environment overrides this, e.g. to use a local stand-in - see mock_services.py)
+NOMINATIM_URL = os.environ.get("NOMINATIM_URL", "http://192.168.1.53:8080/search")
+# Number of records geolocated at once. A local Nominatim container copes with far more
+# parallelism than one query at a time; each thread gets its own keep-alive connection.
+NOMINATIM_WORKERS = 8
+# Records read, checked and geolocated together
+GEOLOCATE_BATCH_SIZE = 1000
 
-def recursive_search(parts, tried=None):
-    """
-    Given a list of address parts, recursively try every combination of removals.
-    Returns (lat, lon) if found, otherwise (None, None).
-    """
-    if tried is None:
-        tried = set()
+# When an address isn't found as written, up to this many variants of it are tried
+MAX_QUERIES_PER_RECORD = 12
 
-    address = join_address_parts(parts)
-    if address in tried:
-        return None, None
-    tried.add(address)
+nominatim = NominatimClient(NOMINATIM_URL, max_connections=NOMINATIM_WORKERS)
+query_cache = GeocodeCache(table="nominatim_queries")
 
-    # Try the current combination.
-    lat, lon = query_nominatim(address)
-    if lat and lon:
-        return lat, lon
 
-    # If there is only one part left, nothing to remove further.
-    if len(parts) <= 1:
+def query_nominatim(address):
+    """
+    Query Nominatim, remembering every answer (found or not) in the persistent query cache,
+    so no query is ever sent twice - within a run or across runs. Errors aren't cached.
+    """
+    cached = query_cache.get(address)
+    if cached:
+        lat, lon, _ = cached
+        metrics.count("nominatim.cache_hits")
+    else:
+        metrics.count("nominatim.cache_misses")
+        try:
+            lat, lon = nominatim.search(address)
+        except Exception as e:
+            log.warning("Error querying Nominatim for address '%s': %s", address, e)
+            return None, None
+        query_cache.put(address, lat, lon)
+    # Nominatim returns coordinates as strings, so keep them that way.
+    if lat is None:
         return None, None
+    return str(lat), str(lon)
 
-    # Try removing one part at a time.
-    for i in range(len(parts)):
-        new_parts = parts[:i] + parts[i+1:]
-        lat, lon = recursive_search(new_parts, tried)
-        if lat and lon:
-            return lat, lon
-    return None, None
 
 def get_lat_lon_modified(address):
     """
-    Attempts to get lat/lon for the full address. If not found, falls back:
-      1. Remove the last comma-separated part.
-      2. Remove the first comma-separated part.
-      3. If still not found, do an exhaustive recursive search.
+    Try the ranked variants of an address (see address_variants.py) until one is found,
+    giving up after MAX_QUERIES_PER_RECORD variants.
     """
-    # Try full address.
-    print(f"Trying full address: '{address}'")
-    lat, lon = query_nominatim(address)
-    if lat and lon:
-        return lat, lon
-
-    # Split into parts.
-    parts = [p.strip() for p in address.split(",")]
-    if len(parts) > 1:
-        # 1. Remove the last part.
-        attempt = join_address_parts(parts[:-1])
-        print(f"Trying without last part: '{attempt}'")
-        lat, lon = query_nominatim(attempt)
-        if lat and lon:
-            return lat, lon
-
-        # 2. Remove the first part.
-        attempt = join_address_parts(parts[1:])
-        print(f"Trying without first part: '{attempt}'")
+    for attempt_number, attempt in enumerate(generate_address_variants(address), start=1):
+        if attempt_number > MAX_QUERIES_PER_RECORD:
+            log.debug("Query budget used up for '%s'", address)
+            metrics.count("addresses.query_budget_used_up")
+            break
+        log.debug("Trying '%s'", attempt)
         lat, lon = query_nominatim(attempt)
         if lat and lon:
             return lat, lon
-
-        # 3. Optionally, try removing both first and last parts if there are enough parts.
-        if len(parts) > 2:
-            attempt = join_address_parts(parts[1:-1])
-            print(f"Trying without first and last parts: '{attempt}'")
-            lat, lon = query_nominatim(attempt)
-            if lat and lon:
-                return lat, lon
-
-    # If these simple removals failed, do an exhaustive recursive search.
-    print("Starting exhaustive recursive search...")
-    lat, lon = recursive_search(parts)
-    if lat and lon:
-        print("Exhaustive search succeeded.")
-    else:
-        print("Exhaustive search failed.")
-    return lat, lon
-
-
-print("Loading psc json")
-with open(input_file, "r", encoding="utf-8") as infile:
-    records = json.load(infile)
-
-new_records = []
-already = 0
-success = 0
-fail = 0
+    return None, None
 
 
-for idx, record in enumerate(records): 
-    
-    if DEBUG_LIMIT and idx > DEBUG_LIMIT:
-        print("DEBUG LIMIT REACHED")
-        break
-    
+def check_record(idx, record):
+    """Check a record, returning its company_details if it needs geolocating, else None."""
     company_number = record.get("company_number")
     company_details = record.get("company_details", {})
-    
+
     if not company_number:
-        print(f"ERROR: can't find company number for {company_name}")
-        print(record)
+        log.error("can't find company number: %s", record)
         exit(1)
-    
+
     company_name = company_details.get("company_name")
     if not company_name:
-        print(f"ERROR: can't find company name for {company_number}")
-        print(record)
+        log.error("can't find company name for %s: %s", company_number, record)
         exit(1)
-        
+
     address = company_details.get("address")
-        
+
     if company_details.get("lat"):
-        print(f"{idx}: {company_name}: already geolocated")
-        already += 1
-        
+        log.debug("%d: %s: already geolocated", idx, company_name)
+        metrics.count("records.already_geolocated")
+
     elif not address:
-        print(f"{idx}: {company_name}: no address")
-        print("")
-        print(record)
+        log.error("%d: %s: no address: %s", idx, company_name, record)
         exit()
-        fail += 1
-        
+        metrics.count("records.failed")
+
     else:
-        lat, lon = get_lat_lon_modified(address)
-        
-        if lat:
-            print(f"{idx}: {company_name}: geolocated to {lat, lon}")
-            company_details["lat"], company_details["lon"] = lat, lon
-            success += 1
-        
-        else:
-            print(f"{idx}: {company_name}: can't geolocate {address}")
-            fail += 1
-
-    new_records.append(record)
-
-# Export the new records to the output file.
-with open(output_file, "w", encoding="utf-8") as outfile:
-    json.dump(new_records, outfile, indent=2)
-
-print(f"\nExported {len(new_records)} records to {output_file}")
-print(f"{success} geolocated")
-print(f"{already} already geolocated")
-print(f"{fail} failed")
+        return company_details
+    return None
+
+
+def geolocated_records(executor):
+    """
+    The records, geolocating a batch at a time: each record in a batch is checked, then the ones
+    that need it are geolocated NOMINATIM_WORKERS at a time. executor.map returns the results in order.
+    """
+    records = enumerate(read_records(input_file))
+    if DEBUG_LIMIT:
+        records = islice(records, DEBUG_LIMIT + 1)
+    while batch := list(islice(records, GEOLOCATE_BATCH_SIZE)):
+        to_geolocate = []
+        for idx, record in batch:
+            company_details = check_record(idx, record)
+            if company_details is not None:
+                to_geolocate.append((idx, company_details.get("company_name"), company_details))
+
+        results = executor.map(get_lat_lon_modified, [company_details["address"] for _, _, company_details in to_geolocate])
+        for (idx, company_name, company_details), (lat, lon) in zip(to_geolocate, results):
+            if lat:
+                log.debug("%d: %s: geolocated to %s", idx, company_name, (lat, lon))
+                company_details["lat"], company_details["lon"] = lat, lon
+                metrics.count("records.geolocated")
+
+            else:
+                log.debug("%d: %s: can't geolocate %s", idx, company_name, company_details['address'])
+                metrics.count("records.failed")
+
+        for _, record in batch:
+            yield record
+        metrics.progress("records", len(batch))
+
+
+log.info("Geolocating addresses with %d workers", NOMINATIM_WORKERS)
+with ThreadPoolExecutor(max_workers=NOMINATIM_WORKERS) as executor, metrics.timer("write_output"):
+    # Export the new records to the output file as they're made.
+    exported = write_records(output_file, geolocated_records(executor))
+
+log.info("Exported %d records to %s", exported, output_file)
+log.info("%d geolocated", metrics.counter("records.geolocated"))
+log.info("%d already geolocated", metrics.counter("records.already_geolocated"))
+log.info("%d failed", metrics.counter("records.failed"))
+log.info("%d queries answered from the cache", metrics.counter("nominatim.cache_hits"))
+log.info("%s", nominatim.latency.format_summary("Nominatim queries"))
+log.info("%d Nominatim errors", metrics.counter("nominatim.errors"))
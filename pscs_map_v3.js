@@ -33,6 +33,14 @@ let linkedPSCIds = [];
 // Maximum number of items to load - when developing/debugging, set to e.g. 1000
 const debug_limit = 1e9;                                  
 
+// The map's data, written by pscs_export_web.py: one array per field, and tables of the values that repeat
+const DATA_URL = "pscs_map_v3_data.json";
+const DATA_FORMAT_VERSION = 1;
+let webData = null;
+
+// The bit flags in the data's warnings column
+const WARNINGS = [[1, "accounts overdue"], [2, "disputed registered office"], [4, "undeliverable registered office"]];
+
 // Initialize map at a global view
 const map = L.map('map', { center: [54, -2], zoom: 2, zoomControl: false, attributionControl: false });
 map.on("popupopen", e => activeMarker = e.popup._source);
@@ -71,25 +79,6 @@ function createBigIcon(markerColor) {
   }
 
 
-// Convert a comma-separated string to title case.
-function toTitleCase(str) {
-    return str.split(',')
-            .map(part => part.trim()
-                                .split(' ')
-                                .map(word => word.charAt(0).toUpperCase() + word.slice(1).toLowerCase())
-                                .join(' '))
-            .join(', ');
-}
-
-// Determine marker color based on company details.
-function getMarkerColor(company_status, ceased_on, accounts_overdue, registered_office_is_in_dispute, undeliverable_registered_office_address, accounts_type) {
-    if (company_status !== "Active") return "black";
-    if (ceased_on) return "grey";
-    if (accounts_overdue || registered_office_is_in_dispute || undeliverable_registered_office_address) return "red";
-    if (accounts_type === "dormant") return "orange";
-    return "green";
-}
-
 // Generate the popup HTML for a marker.
 function generatePopup(psc_html, address_text, uk_company_html, uk_company_address, incorporation_date, company_status, warnings_html, accounts_type, SICs, companyId) {
     let popup = `<b>PSC: ${psc_html}</b><br>${address_text}<br><br>Owner of ${uk_company_html}`;
@@ -307,114 +296,132 @@ function showHamburger() {
   
 
 /*********************** MAIN FUNCTION: LOAD MARKERS **************************/
+// Fetch the map's data, gzipped if the browser can decompress it, otherwise as plain json.
+// It's kept once loaded, so switching mode doesn't download it again.
+function fetchWebData() {
+    if (webData) return Promise.resolve(webData);
+    const fetchPlain = () => fetch(DATA_URL).then(response => {
+        if (!response.ok) throw new Error(`HTTP ${response.status} for ${DATA_URL}`);
+        return response.json();
+    });
+    let loading;
+    if (typeof DecompressionStream === "undefined") {
+        loading = fetchPlain();
+    } else {
+        loading = fetch(DATA_URL + ".gz")
+            .then(response => {
+                if (!response.ok) throw new Error(`HTTP ${response.status} for ${DATA_URL}.gz`);
+                return response.arrayBuffer();
+            })
+            .then(buffer => {
+                const bytes = new Uint8Array(buffer);
+                // A server that sends .gz files with Content-Encoding: gzip has had the browser decompress it already
+                if (bytes[0] !== 0x1f || bytes[1] !== 0x8b) return JSON.parse(new TextDecoder().decode(bytes));
+                const stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream("gzip"));
+                return new Response(stream).json();
+            })
+            .catch(() => fetchPlain());
+    }
+    return loading.then(data => {
+        if (data.version !== DATA_FORMAT_VERSION) {
+            throw new Error(`Expected version ${DATA_FORMAT_VERSION} of ${DATA_URL}, not ${data.version}`);
+        }
+        webData = data;
+        return data;
+    });
+}
+
+// Build the popup HTML for the i'th record; only done when its popup is opened.
+function popupForRecord(data, i) {
+    const columns = data.columns;
+    const tables = data.tables;
+
+    // Build company information strings
+    const company_number = columns.company_number[i];
+    const uk_company_name = columns.company_name[i] || "Unknown UK Company";
+    const uk_url = "https://find-and-update.company-information.service.gov.uk/company/" + company_number;
+    const uk_company_html = `<b><a href="${uk_url}" target="_blank">${uk_company_name}</a></b>`;
+
+    // Build PSC information string
+    const psc_name = columns.psc_name[i] || "UNKNOWN PSC";
+    const psc_url = "https://find-and-update.company-information.service.gov.uk/company/" + company_number + "/persons-with-significant-control";
+    let psc_html = `<b><a href="${psc_url}" target="_blank">${psc_name}</a></b>`;
+    if (columns.ceased_on[i]) {
+        psc_html += `<br><span style='font-size:12px;'>(ceased to be PSC on ${columns.ceased_on[i]})</span>`;
+    }
+
+    // Build warnings string (if any)
+    const warnings_html = WARNINGS.filter(([flag]) => columns.warnings[i] & flag).map(([, text]) => text).join("<br>");
+
+    // The PSC address, with its country
+    const address_parts = [columns.psc_address[i], tables.psc_country[columns.psc_country[i]]].filter(part => part);
+    const address_text = address_parts.join(", ");
+
+    return generatePopup(psc_html, address_text, uk_company_html, columns.uk_address[i], columns.incorporation_date[i],
+                         tables.company_status[columns.company_status[i]], warnings_html,
+                         tables.accounts_type[columns.accounts_type[i]], tables.SICs[columns.SICs[i]], company_number);
+}
+
 function loadMarkers() {
-    $.ajax({
-    dataType: "json",
-    url: "pscs_list_of_non-uk_corp_pscs_v3.5.json", // Using the latest JSON version
-    success: function(data) {
-        // Loop through each data item (limit based on debug_limit)
-        for (let i = 0; i < Math.min(data.length, debug_limit); i++) {
-        const item = data[i];
+    fetchWebData()
+    .then(data => {
+        const columns = data.columns;
+        const categories = data.tables.category;
+        // One icon for each category's markers
+        const icons = {};
+        categories.forEach(category => {
+            const iconHtml = `<div style="background-color:${category}; width:12px; height:12px; border-radius:50%; border:1px solid black;"></div>`;
+            icons[category] = L.divIcon({ html: iconHtml, className: '' });
+        });
+
+        // Loop through each record (limit based on debug_limit)
+        for (let i = 0; i < Math.min(data.count, debug_limit); i++) {
         // Choose coordinates based on the current mode
         let lat, lon;
-        if (useUKCompanyLocation && item.company_details && item.company_details.lat && item.company_details.lon) {
-            lat = item.company_details.lat;
-            lon = item.company_details.lon;
+        if (useUKCompanyLocation && columns.uk_lat[i] != null && columns.uk_lon[i] != null) {
+            lat = columns.uk_lat[i];
+            lon = columns.uk_lon[i];
         } else {
-            lat = item.latitude;
-            lon = item.longitude;
+            lat = columns.psc_lat[i];
+            lon = columns.psc_lon[i];
         }
         if (lat == null || lon == null) continue;
-        
-        // Destructure company details and PSC data
-        const company_details = item.company_details || {};
-        const psc_data = item.data || {};
-        
-        // Extract flags and details
-        const accounts_overdue = company_details.accounts_overdue || false;
-        const registered_office_is_in_dispute = company_details.registered_office_is_in_dispute || false;
-        const undeliverable_registered_office_address = company_details.undeliverable_registered_office_address || false;
-        const ceased_on = psc_data.ceased_on;
-        
-        const accounts_type = company_details.accounts_type || "";
-        const incorporation_date = company_details.incorporation_date || "";
-        const company_status = company_details.company_status || "";
-        const SICs = company_details.SICs || "";
-        
-        // Determine marker color using helper function
-        const marker_color = getMarkerColor(company_status, ceased_on, accounts_overdue, registered_office_is_in_dispute, undeliverable_registered_office_address, accounts_type);
-        
-        // Build company information strings
-        const company_number = item.company_number;
-        const uk_company_name = company_details.company_name || "Unknown UK Company";
-        const uk_url = "https://find-and-update.company-information.service.gov.uk/company/" + company_number;
-        const uk_company_html = `<b><a href="${uk_url}" target="_blank">${uk_company_name}</a></b>`;
-        
-        // Build PSC information string
-        // PSC details
-        let psc_name = psc_data.name.toUpperCase() || "UNKNOWN PSC";
-        
-        const psc_url = "https://find-and-update.company-information.service.gov.uk/company/" + company_number + "/persons-with-significant-control";
-        let psc_html = `<b><a href="${psc_url}" target="_blank">${psc_name}</a></b>`;
-
-        if (psc_data.ceased_on) {
-            psc_html += `<br><span style='font-size:12px;'>(ceased to be PSC on ${psc_data.ceased_on})</span>`;
-        }
-        
-
-        // Build warnings string (if any)
-        const warnings = [];
-        if (accounts_overdue) warnings.push("accounts overdue");
-        if (registered_office_is_in_dispute) warnings.push("disputed registered office");
-        if (undeliverable_registered_office_address) warnings.push("undeliverable registered office");
-        const warnings_html = warnings.join("<br>");
-        
-        
-        // Build the PSC address (from PSC data)
-        const address_data = psc_data.address || {};
-        const address_parts = [];
-        ["premises", "address_line_1", "locality", "region", "country"].forEach(key => {
-            if (address_data[key]) address_parts.push(address_data[key]);
-        });
-        const address_text = address_parts.join(", ");
-        
-        // UK company address in title case (if available)
-        const uk_company_address = company_details.address ? toTitleCase(company_details.address) : "";
-        
-        // Generate the popup HTML using our helper function
-        const popup_html = generatePopup(psc_html, address_text, uk_company_html, uk_company_address, incorporation_date, company_status, warnings_html, accounts_type, SICs, company_number);
 
-        
-        // Create a custom marker with a divIcon
-        const iconHtml = `<div style="background-color:${marker_color}; width:12px; height:12px; border-radius:50%; border:1px solid black;"></div>`;
+        // The marker's colour is worked out by pscs_export_web.py
+        const marker_color = categories[columns.category[i]];
+        const uk_company_name = columns.company_name[i] || "Unknown UK Company";
         const marker = L.marker([lat, lon], {
             title: uk_company_name,
-            icon: L.divIcon({ html: iconHtml, className: '' })
-        }).bindPopup(popup_html);
-        
+            icon: icons[marker_color]
+        }).bindPopup(() => popupForRecord(data, i));
+
         // Add custom properties for search and identification
-        marker.myId = company_number;
+        marker.myId = columns.company_number[i];
         marker.myCompanyName = uk_company_name.toLowerCase();
-        marker.myPSCName = psc_name.toLowerCase();
+        marker.myPSCName = (columns.psc_name[i] || "UNKNOWN PSC").toLowerCase();
         marker.category = marker_color;
 
         // In UK mode, the marker’s position is at the UK company location.
-        marker.ukLat = (company_details && company_details.lat) || null;
-        marker.ukLon = (company_details && company_details.lon) || null;
-        // The PSC coordinates come from the main item (which is used in PSC mode).
-        marker.pscLat = item.latitude;
-        marker.pscLon = item.longitude;
-        
-        // Add marker to our tracking arrays and to the appropriate cluster
+        marker.ukLat = columns.uk_lat[i];
+        marker.ukLon = columns.uk_lon[i];
+        // The PSC coordinates (which are used in PSC mode).
+        marker.pscLat = columns.psc_lat[i];
+        marker.pscLon = columns.psc_lon[i];
+
+        // Add marker to our tracking arrays
         markersArray.push(marker);
         markersByCategory[marker_color].push(marker);
-        markerClusters[marker_color].addLayer(marker);
         }
-    },
-    error: function(err) {
-        console.error("Error loading JSON data:", err);
-    },
-    complete: function() {
+
+        // Adding each cluster's markers all at once is much faster than one at a time
+        Object.keys(markersByCategory).forEach(category => {
+            markerClusters[category].addLayers(markersByCategory[category]);
+        });
+    })
+    .catch(err => {
+        console.error("Error loading map data:", err);
+    })
+    .finally(() => {
         // Hide the loading overlay.
         $('#loading-overlay').fadeOut();
     
@@ -430,7 +437,6 @@ function loadMarkers() {
                 setCookie("tutorialSeen", "true", 365); // Set cookie for 1 year
             }
         }
-    }
     });
 }
 
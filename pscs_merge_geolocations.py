@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+from pipeline_io import stage_paths, read_records, write_records
+import metrics
+from metrics import log
+
+# The postcode and address geolocation stages both start from the same file and keep every
+# record in order, each adding coordinates to the records it can. This combines them, taking
+# the postcode's coordinates where both found some.
+
+# Input and output file paths
+input_file = ["pscs_list_of_non-uk_corp_pscs_v3.4-with-more-postcodes.jsonl",
+              "pscs_list_of_non-uk_corp_pscs_v3.4-additional-addresses.jsonl"]
+output_file = "pscs_list_of_non-uk_corp_pscs_v3.4.jsonl"
+input_file, output_file = stage_paths(input_file, output_file)
+metrics.setup_stage(output_file)
+
+added = {path: 0 for path in input_file[1:]}
+
+
+def merged_records():
+    """The first input's records, with coordinates from the others where it has none."""
+    streams = [read_records(path) for path in input_file]
+    for idx, (record, *others) in enumerate(zip(*streams, strict=True)):
+        company_details = record.get("company_details", {})
+        for path, other in zip(input_file[1:], others):
+            if record.get("company_number") != other.get("company_number"):
+                log.error("record %d is company %s in %s but %s in %s", idx, record.get('company_number'),
+                          input_file[0], other.get('company_number'), path)
+                exit(1)
+            other_details = other.get("company_details", {})
+            if not company_details.get("lat") and other_details.get("lat"):
+                company_details["lat"], company_details["lon"] = other_details["lat"], other_details["lon"]
+                added[path] += 1
+        if company_details.get("lat"):
+            metrics.count("records.geolocated")
+        metrics.progress("records")
+        yield record
+
+
+# Export the merged records to the output file as they're made.
+with metrics.timer("write_output"):
+    exported = write_records(output_file, merged_records())
+
+for path, count in added.items():
+    log.info("%d geolocations added from %s", count, path)
+metrics.set_value("geolocations_added", added)
+log.info("Exported %d records to %s, %d geolocated", exported, output_file, metrics.counter("records.geolocated"))
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Runs the whole pipeline, from the PSC snapshot to the json the webapp loads.
+
+The stages, and the files each reads and writes, are declared in STAGES below; a stage depends
+on any stage that writes one of its inputs. Each stage is run as its own process, with its
+files passed as --input/--output (see pipeline_io.py), and its output logged to PIPELINE_LOG_DIR.
+
+A stage is skipped if nothing it depends on has changed since it last succeeded: its fingerprint
+is a hash of its script and the local modules it imports, of its input and data files, and of
+its arguments. Stages that don't depend on each other (e.g. postcode and address geolocation)
+run at the same time. A timing report is printed at the end.
+
+    python pscs_pipeline.py                    # run everything that's out of date
+    python pscs_pipeline.py add_names          # just add_names, and anything it depends on
+    python pscs_pipeline.py --force add_names  # run add_names even if it's up to date
+    python pscs_pipeline.py --force            # run everything
+    python pscs_pipeline.py --dry-run          # show what would run
+    python pscs_pipeline.py --previous-run 2025-02  # delta mode: reuse last month's results (in
+                                                    # folder 2025-02) for unchanged PSCs
+"""
+import argparse
+import ast
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from snapshot_files import snapshot_parts
+from company_snapshot import SNAPSHOT_FILE as COMPANY_SNAPSHOT_FILE
+from postcode_index import CODEPOINT_CSV_FOLDER
+
+PSC_SNAPSHOT_FILE = "companies_house_data/persons-with-significant-control-snapshot-2025-03-16.txt"
+
+PIPELINE_STATE_FILE = "pipeline_state.json"
+PIPELINE_LOG_DIR = "pipeline_logs"
+# Stages run at once, at most
+PIPELINE_JOBS = 4
+# gzip the files passed between stages (not the final json the webapp loads)
+PIPELINE_COMPRESS = False
+
+
+def intermediate(path):
+    return f"{path}.gz" if PIPELINE_COMPRESS else path
+
+
+# Each stage's first output is the one passed as --output; any others are written by the
+# stage to fixed paths. "data" is the other files (or folders) the stage reads. "delta" stages
+# are the paid ones, which can reuse the previous run's results (see psc_delta.py).
+STAGES = [
+    {"name": "find_non_uk_corporates", "script": "pscs_find_non-UK_corporates",
+     "inputs": [PSC_SNAPSHOT_FILE],
+     "outputs": ["non-UK_corporate_pscs.txt", "non_uk_counts.csv", "non_uk_counts_summary.json"]},
+    {"name": "find_geodata", "script": "pscs_find_geodata",
+     "inputs": ["non-UK_corporate_pscs.txt"],
+     "outputs": [intermediate("non_uk_corporate_pscs_with_coords.jsonl")],
+     "delta": True},
+    {"name": "add_names", "script": "pscs_add_names",
+     "inputs": [intermediate("non_uk_corporate_pscs_with_coords.jsonl")],
+     "outputs": [intermediate("uk_corp_pscs_geo_and_details.jsonl")],
+     "data": [COMPANY_SNAPSHOT_FILE],
+     "delta": True},
+    {"name": "remove_uk_pscs", "script": "pscs_remove_uk_pscs.py",
+     "inputs": [intermediate("uk_corp_pscs_geo_and_details.jsonl")],
+     "outputs": [intermediate("non-uk_corp_pscs_geo_and_details.jsonl")]},
+    {"name": "remove_uk_listed", "script": "pscs_remove_uk_listed_pscs.py",
+     "inputs": [intermediate("non-uk_corp_pscs_geo_and_details.jsonl")],
+     "outputs": [intermediate("pscs_list_of_non-uk_corp_pscs_geo_and_details.jsonl")],
+     "data": ["pscs_uk_listed_companies.txt"]},
+    {"name": "add_dissolution", "script": "pscs_add_dissolution_and_misc_data.py",
+     "inputs": [intermediate("pscs_list_of_non-uk_corp_pscs_geo_and_details.jsonl")],
+     "outputs": [intermediate("pscs_list_of_non-uk_corp_pscs_v2-wrong.jsonl")],
+     "data": [COMPANY_SNAPSHOT_FILE]},
+    {"name": "remove_us_listed", "script": "pscs_remove_us_listed.py",
+     "inputs": [intermediate("pscs_list_of_non-uk_corp_pscs_v2-wrong.jsonl")],
+     "outputs": [intermediate("pscs_list_of_non-uk_corp_pscs_v2.jsonl")],
+     "data": ["pscs_nasdaqlisted.txt", "pscs_nyse-listed.csv", "pscs_other-listed.csv"]},
+    {"name": "add_uk_addresses", "script": "pscs_add_UK_addresses_with_api.py",
+     "inputs": [intermediate("pscs_list_of_non-uk_corp_pscs_v2.jsonl")],
+     "outputs": [intermediate("pscs_list_of_non-uk_corp_pscs_v3.3-with-postcode-and-address-lookup-with-api.jsonl")],
+     "data": ["sic_codes.json", COMPANY_SNAPSHOT_FILE, CODEPOINT_CSV_FOLDER],
+     "delta": True},
+    {"name": "geolocate_by_postcode", "script": "pscs_geolocate_UK_addresses_by_postcode.py",
+     "inputs": [intermediate("pscs_list_of_non-uk_corp_pscs_v3.3-with-postcode-and-address-lookup-with-api.jsonl")],
+     "outputs": [intermediate("pscs_list_of_non-uk_corp_pscs_v3.4-with-more-postcodes.jsonl")],
+     "data": [CODEPOINT_CSV_FOLDER]},
+    {"name": "geolocate_by_address", "script": "pscs_geolocate_UK_addresses_by_address.py",
+     "inputs": [intermediate("pscs_list_of_non-uk_corp_pscs_v3.3-with-postcode-and-address-lookup-with-api.jsonl")],
+     "outputs": [intermediate("pscs_list_of_non-uk_corp_pscs_v3.4-additional-addresses.jsonl")]},
+    {"name": "merge_geolocations", "script": "pscs_merge_geolocations.py",
+     "inputs": [intermediate("pscs_list_of_non-uk_corp_pscs_v3.4-with-more-postcodes.jsonl"),
+                intermediate("pscs_list_of_non-uk_corp_pscs_v3.4-additional-addresses.jsonl")],
+     "outputs": [intermediate("pscs_list_of_non-uk_corp_pscs_v3.4.jsonl")]},
+    {"name": "remove_global_listed", "script": "pscs_remove_global_listed.py",
+     "inputs": [intermediate("pscs_list_of_non-uk_corp_pscs_v3.4.jsonl")],
+     "outputs": ["pscs_list_of_non-uk_corp_pscs_v3.5.json"],
+     "data": ["Global_stock_listings_by_exchange_174.csv"]},
+    # (and pscs_map_v3_data.json.br, if the brotli module is installed)
+    {"name": "export_web", "script": "pscs_export_web.py",
+     "inputs": ["pscs_list_of_non-uk_corp_pscs_v3.5.json"],
+     "outputs": ["pscs_map_v3_data.json", "pscs_map_v3_data.json.gz"]},
+]
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class FileHasher:
+    """
+    sha256 of files, folders (all the files in them) and globs (all the files matching).
+    A file's hash is remembered with its size and modification time, so unchanged files -
+    e.g. a multi-GB snapshot - are only ever read once.
+    """
+
+    def __init__(self, known=None):
+        self.known = known or {}
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        known = self.known.get(path)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            while block := f.read(HASH_BLOCK_SIZE):
+                sha.update(block)
+        self.known[path] = [stat.st_size, stat.st_mtime_ns, sha.hexdigest()]
+        return sha.hexdigest()
+
+    def hash(self, path):
+        """The hash of a path, or None if it doesn't exist."""
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+        else:
+            try:
+                files = snapshot_parts(path)
+            except FileNotFoundError:
+                return None
+        if not all(os.path.isfile(f) for f in files):
+            return None
+        if len(files) == 1 and files[0] == path:
+            return self.file_hash(path)
+        sha = hashlib.sha256()
+        for f in files:
+            sha.update(f"{os.path.relpath(f, os.path.dirname(path) or '.')}\0{self.file_hash(f)}\n".encode("utf-8"))
+        return sha.hexdigest()
+
+
+def local_modules(script, seen=None):
+    """The script, and the modules in this folder it imports (directly or not)."""
+    seen = seen if seen is not None else set()
+    if script in seen:
+        return seen
+    seen.add(script)
+    with open(script, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=script)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names = [node.module]
+        else:
+            continue
+        for name in names:
+            module_file = f"{name.split('.')[0]}.py"
+            if os.path.exists(module_file):
+                local_modules(module_file, seen)
+    return seen
+
+
+def stage_command(stage, previous_run=None):
+    command = [sys.executable, stage["script"], "--input", *stage["inputs"], "--output", stage["outputs"][0]]
+    if previous_run and stage.get("delta"):
+        previous_input = os.path.join(previous_run, stage["inputs"][0])
+        previous_output = os.path.join(previous_run, stage["outputs"][0])
+        if os.path.exists(previous_input) and os.path.exists(previous_output):
+            command += ["--previous-input", previous_input, "--previous-output", previous_output]
+    return command
+
+
+def stage_fingerprint(stage, hasher, previous_run=None):
+    """Hash of everything a stage's output depends on, or None if one of its inputs is missing."""
+    command = stage_command(stage, previous_run)
+    # In delta mode, what the previous run produced matters too
+    previous_files = [path for flag, path in zip(command, command[1:]) if flag in ("--previous-input", "--previous-output")]
+    files = {path: hasher.hash(path) for path in stage["inputs"] + stage.get("data", []) + previous_files}
+    if None in files.values():
+        return None
+    code = {module: hasher.hash(module) for module in sorted(local_modules(stage["script"]))}
+    description = {"command": command[1:], "files": files, "code": code}
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def stage_dependencies(stages):
+    """{stage name: names of the stages that write its inputs}."""
+    written_by = {output: stage["name"] for stage in stages for output in stage["outputs"]}
+    return {stage["name"]: sorted({written_by[path] for path in stage["inputs"] if path in written_by})
+            for stage in stages}
+
+
+def with_dependencies(names, dependencies):
+    """The given stage names plus everything upstream of them."""
+    wanted = set()
+    to_visit = list(names)
+    while to_visit:
+        name = to_visit.pop()
+        if name not in wanted:
+            wanted.add(name)
+            to_visit.extend(dependencies[name])
+    return wanted
+
+
+def load_state():
+    if os.path.exists(PIPELINE_STATE_FILE):
+        with open(PIPELINE_STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"stages": {}, "file_hashes": {}}
+
+
+def save_state(state):
+    temp_file = f"{PIPELINE_STATE_FILE}.tmp"
+    with open(temp_file, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(temp_file, PIPELINE_STATE_FILE)
+
+
+def is_up_to_date(stage, fingerprint, state, hasher):
+    """True if the stage last succeeded with this fingerprint and its outputs haven't changed since."""
+    previous = state["stages"].get(stage["name"])
+    if not previous or previous["fingerprint"] != fingerprint:
+        return False
+    return all(hasher.hash(path) == previous["outputs"].get(path) for path in stage["outputs"])
+
+
+def run_stage(stage, previous_run=None):
+    """Run one stage, logging its output. Returns (succeeded, seconds)."""
+    os.makedirs(PIPELINE_LOG_DIR, exist_ok=True)
+    log_file = os.path.join(PIPELINE_LOG_DIR, f"{stage['name']}.log")
+    start = time.monotonic()
+    with open(log_file, "w", encoding="utf-8") as log:
+        result = subprocess.run(stage_command(stage, previous_run), stdout=log, stderr=subprocess.STDOUT)
+    return result.returncode == 0, time.monotonic() - start
+
+
+def run_pipeline(targets=None, force=(), jobs=PIPELINE_JOBS, dry_run=False, previous_run=None):
+    """
+    Run the stages needed for targets (all stages if None), in dependency order, jobs at a time.
+    force is a collection of stage names to run even if they're up to date (True for all of them).
+    previous_run is a folder holding the previous run's files, for delta mode.
+    Returns {stage name: (status, seconds)}.
+    """
+    stages = {stage["name"]: stage for stage in STAGES}
+    dependencies = stage_dependencies(STAGES)
+    wanted = with_dependencies(targets, dependencies) if targets else set(stages)
+    state = load_state()
+    hasher = FileHasher(state.setdefault("file_hashes", {}))
+
+    results = {}
+    running = {}
+    fingerprints = {}
+    pipeline_start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            # Start (or skip) every stage whose dependencies are all done
+            for name in [n for n in stages if n in wanted and n not in results and n not in running.values()]:
+                upstream = [results.get(d, (None,))[0] for d in dependencies[name]]
+                if any(status in ("failed", "blocked", "missing input") for status in upstream):
+                    results[name] = ("blocked", 0)
+                    continue
+                if dry_run and any(status == "would run" for status in upstream):
+                    results[name] = ("would run", 0)
+                    continue
+                if not all(status in ("ran", "up to date", "would run") for status in upstream):
+                    continue
+                stage = stages[name]
+                fingerprint = stage_fingerprint(stage, hasher, previous_run)
+                if fingerprint is None:
+                    print(f"{name}: missing input, not run")
+                    results[name] = ("missing input", 0)
+                elif (force is not True and name not in force) and is_up_to_date(stage, fingerprint, state, hasher):
+                    print(f"{name}: up to date")
+                    results[name] = ("up to date", 0)
+                elif dry_run:
+                    results[name] = ("would run", 0)
+                else:
+                    print(f"{name}: running {' '.join(stage_command(stage, previous_run)[1:])}")
+                    running[executor.submit(run_stage, stage, previous_run)] = name
+                    fingerprints[name] = fingerprint
+
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                stage = stages[name]
+                succeeded, seconds = future.result()
+                if succeeded:
+                    print(f"{name}: finished in {seconds:.1f}s")
+                    results[name] = ("ran", seconds)
+                    state["stages"][name] = {
+                        "fingerprint": fingerprints[name],
+                        "outputs": {path: hasher.hash(path) for path in stage["outputs"]},
+                        "seconds": seconds,
+                    }
+                    save_state(state)
+                else:
+                    print(f"{name}: FAILED after {seconds:.1f}s, see {os.path.join(PIPELINE_LOG_DIR, name + '.log')}")
+                    results[name] = ("failed", seconds)
+
+    save_state(state)
+    print_timing_report(results, time.monotonic() - pipeline_start)
+    return results
+
+
+def print_timing_report(results, elapsed):
+    print("")
+    print(f"{'stage':<25} {'status':<14} {'seconds':>10}")
+    for stage in STAGES:
+        if stage["name"] in results:
+            status, seconds = results[stage["name"]]
+            print(f"{stage['name']:<25} {status:<14} {seconds:>10.1f}")
+    total = sum(seconds for _, seconds in results.values())
+    print(f"{'total':<25} {'':<14} {total:>10.1f}")
+    print(f"Wall time {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the pipeline stages that are out of date.")
+    parser.add_argument("stages", nargs="*", help="stages to bring up to date (default: all)")
+    parser.add_argument("--force", action="store_true", help="run the stages named even if up to date (no names: all of them)")
+    parser.add_argument("--jobs", type=int, default=PIPELINE_JOBS, help="stages to run at once")
+    parser.add_argument("--dry-run", action="store_true", help="only show what would run")
+    parser.add_argument("--previous-run", help="folder with the previous run's files, to reuse results for unchanged PSCs")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.stages if name not in {s["name"] for s in STAGES}]
+    if unknown:
+        parser.error(f"unknown stages: {', '.join(unknown)}")
+    force = (set(args.stages) or True) if args.force else ()
+    results = run_pipeline(args.stages or None, force=force, jobs=args.jobs, dry_run=args.dry_run,
+                           previous_run=args.previous_run)
+    sys.exit(1 if any(status in ("failed", "blocked", "missing input") for status, _ in results.values()) else 0)
@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
-import json
 import string
+from pipeline_io import stage_paths, read_records, write_records
+import metrics
+from metrics import log
 
 # uses list of issuers from https://www.londonstockexchange.com/reports?tab=issuers
 listed_company_file = 'pscs_uk_listed_companies.txt'
 
 # Input and output file paths
-input_file = "non-uk_corp_pscs_geo_and_details-with-uk-listed.json"
-output_file = "pscs_list_of_non-uk_corp_pscs_geo_and_details.json"
+input_file = "non-uk_corp_pscs_geo_and_details-with-uk-listed.jsonl"
+output_file = "pscs_list_of_non-uk_corp_pscs_geo_and_details.jsonl"
+input_file, output_file = stage_paths(input_file, output_file)
+metrics.setup_stage(output_file)
 
 # Load the listed companies from the file into a set for efficient lookup
 def load_listed_companies(filepath):
@@ -26,21 +30,20 @@ def is_company_uk_listed(company, listed_companies_set):
 listed_companies = load_listed_companies(listed_company_file)
 
 
-with open(input_file, "r", encoding="utf-8") as infile:
-    records = json.load(infile)
+def unlisted_records():
+    for idx, record in enumerate(read_records(input_file)):
+        metrics.progress("records")
+        name = record.get("data").get("name")
+        if is_company_uk_listed(name, listed_companies  ):
+            log.debug("%d: %s is UK listed", idx, name)
+            metrics.count("records.listed")
+            continue
+        yield record
 
-new_records = []
-listed_count = 0
-for idx, record in enumerate(records): 
-    name = record.get("data").get("name")
-    if is_company_uk_listed(name, listed_companies  ):
-        print(f"{idx}: {name} is UK listed")
-        listed_count += 1
-        continue
-    new_records.append(record)
 
-# Export the new records to the output file.
-with open(output_file, "w", encoding="utf-8") as outfile:
-    json.dump(new_records, outfile, indent=2)
+# Export the new records to the output file as they're found.
+with metrics.timer("write_output"):
+    exported = write_records(output_file, unlisted_records())
 
-print(f"Exported {len(new_records)} records to {output_file}, removing {listed_count} listed companies")
+log.info("Exported %d records to %s, removing %d listed companies", exported, output_file,
+         metrics.counter("records.listed"))
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Thread-safe token bucket, shared by every thread that calls the same API so that together
+they stay within the provider's request rate.
+"""
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Allows on average `rate` acquisitions per second, with bursts of up to `capacity`.
+    acquire() blocks the calling thread only, until a token is available.
+    The rate can be changed, and all acquisitions paused, while the bucket is in use.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + max(0, now - self._updated) * self.rate)
+        self._updated = max(now, self._updated)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+    def pause(self, seconds):
+        """Hand out no tokens for the next `seconds` seconds (e.g. after being told to slow down)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            # Start refilling from empty once the pause is over
+            self._tokens = 0
+            self._updated = self._paused_until
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                else:
+                    self._refill(now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def backoff_delay(attempt, base=1, maximum=60):
+    """Exponential backoff with jitter for the given retry attempt (1, 2, 3...)."""
+    delay = min(maximum, base * 2 ** (attempt - 1))
+    return delay * random.uniform(0.5, 1)
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Open Companies House bulk snapshots as downloaded, without unzipping them first.
+
+A snapshot path may be:
+  - the extracted .txt / .csv file
+  - the downloaded .zip, which is decompressed on the fly as it is read
+  - a glob pattern such as "psc-snapshot-2025-03-16_*of*.zip" for the multi-part downloads,
+    whose parts are read in numerical order
+"""
+import glob
+import io
+import os
+import re
+import zipfile
+from contextlib import contextmanager
+
+
+def natural_sort_key(path):
+    """Sort key that puts part 2 before part 10."""
+    return [int(token) if token.isdigit() else token for token in re.split(r"(\d+)", path)]
+
+
+def snapshot_parts(path):
+    """Return the list of files that make up a snapshot, in order."""
+    if any(c in path for c in "*?["):
+        parts = sorted(glob.glob(path), key=natural_sort_key)
+        if not parts:
+            raise FileNotFoundError(f"No snapshot files match {path}")
+        return parts
+    return [path]
+
+
+def is_zip(path):
+    return path.lower().endswith(".zip")
+
+
+def _zip_member(zf):
+    members = [info for info in zf.infolist() if not info.is_dir()]
+    if len(members) != 1:
+        raise ValueError(f"Expected one file in {zf.filename}, found {len(members)}")
+    return members[0]
+
+
+@contextmanager
+def open_part(path):
+    """Open one snapshot file for binary reading, decompressing it as it is read if it's a zip."""
+    if is_zip(path):
+        with zipfile.ZipFile(path) as zf, zf.open(_zip_member(zf)) as f:
+            yield f
+    else:
+        with open(path, "rb") as f:
+            yield f
+
+
+def uncompressed_size(path):
+    """Size in bytes of the data in one snapshot file once decompressed."""
+    if is_zip(path):
+        with zipfile.ZipFile(path) as zf:
+            return _zip_member(zf).file_size
+    return os.path.getsize(path)
+
+
+def iter_text_parts(path, encoding="utf-8"):
+    """
+    Yield each part of a snapshot as a text stream (opened with newline="" so it can be
+    passed straight to the csv module). Each stream is closed when the next one is requested.
+    """
+    for part in snapshot_parts(path):
+        with open_part(part) as f:
+            yield io.TextIOWrapper(f, encoding=encoding, newline="")
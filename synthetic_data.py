@@ -0,0 +1,477 @@
+#!/usr/bin/env python3
+"""
+Synthetic Companies House data, for measuring the pipeline without the multi-GB downloads.
+
+Writes, in the layout and under the file names the stages expect:
+  - a PSC snapshot (JSON lines): individual PSCs, PSC statements and corporate PSCs, a
+    configurable share of them registered outside the UK, with the many spellings of countries
+    the real snapshot has ("England & Wales", "REGISTERED IN ENGLAND", "B.V.I.", ...)
+  - the BasicCompanyData CSV for every company in it, with the real header
+  - Code-Point Open CSVs holding the companies' postcodes (a few are missing or invalid)
+  - the UK, US and global listed company files, some of whose names are also PSC names
+
+and stand-ins for the paid stages (see benchmark.py), which add what those stages would from
+the synthetic company data without calling anything.
+
+    python synthetic_data.py bench_data/10k --records 10000
+
+Everything is generated from the seed, so the same arguments always give the same files.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+from datetime import date, timedelta
+from company_snapshot import SNAPSHOT_FILE, load_company_snapshot
+from pipeline_io import read_records, write_records
+from postcode_index import CODEPOINT_CSV_FOLDER
+
+PSC_SNAPSHOT_FILE = "companies_house_data/persons-with-significant-control-snapshot-2025-03-16.txt"
+MANIFEST_FILE = "synthetic_data.json"
+SYNTHETIC_SEED = 1
+
+# Shares of the snapshot lines that are corporate PSCs and PSC statements (the rest are individuals)
+CORPORATE_SHARE = 0.08
+STATEMENT_SHARE = 0.05
+# Share of corporate PSCs registered outside the UK
+NON_UK_SHARE = 0.12
+# Share of non-UK corporate PSCs named after a listed company, and of those with a UK address
+LISTED_SHARE = 0.03
+UK_ADDRESS_SHARE = 0.1
+MAX_PSCS_PER_COMPANY = 3
+# Companies share postcodes (registered agents especially), so there are fewer postcodes than
+# companies - but never more than the real Code-Point's 1.7 million or so
+COMPANIES_PER_POSTCODE = 3
+MAX_POSTCODES = 1_750_000
+MISSING_POSTCODE_SHARE = 0.03
+INVALID_POSTCODE_SHARE = 0.02
+
+LISTING_SIZES = {"uk": 2_000, "nasdaq": 4_000, "nyse": 3_000, "other": 5_000, "global": 40_000}
+
+CORPORATE_KIND = "corporate-entity-person-with-significant-control"
+
+# Spellings of the UK as they appear in country_registered / place_registered
+UK_COUNTRIES = ["England", "England And Wales", "ENGLAND AND WALES", "England & Wales", "United Kingdom",
+                "UNITED KINGDOM", "Uk", "UK", "Registered In England And Wales", "Scotland", "England, Uk",
+                "Great Britain", "Gb", "Wales", "Northern Ireland", "united kingdom ", "U.K"]
+UK_PLACES = ["Companies House", "Registrar Of Companies For England And Wales", "Companies House, Cardiff",
+             "England", "Uk Register Of Companies", "Companies House Scotland"]
+
+# (spellings of the country, place_registered, legal_authority, legal_form)
+NON_UK_COUNTRIES = [
+    (["British Virgin Islands", "BRITISH VIRGIN ISLANDS", "Bvi", "B.V.I.", "Virgin Islands, British", "Tortola, Bvi"],
+     "Registry Of Corporate Affairs", "BVI Business Companies Act 2004", "Business Company"),
+    (["Jersey", "JERSEY", "Jersey, Channel Islands"], "Jersey Financial Services Commission",
+     "Companies (Jersey) Law 1991", "Private Company Limited By Shares"),
+    (["Guernsey", "Guernsey, Channel Islands"], "Guernsey Registry", "Companies (Guernsey) Law 2008", "Limited Company"),
+    (["Isle Of Man", "ISLE OF MAN", "Isle of Man"], "Isle Of Man Companies Registry", "Companies Act 2006 (Isle Of Man)",
+     "Limited Company"),
+    (["Luxembourg", "LUXEMBOURG", "Grand Duchy Of Luxembourg"], "Luxembourg Trade And Companies Register",
+     "Luxembourg Law", "Societe A Responsabilite Limitee"),
+    (["Cayman Islands", "Cayman", "CAYMAN ISLANDS"], "Cayman Islands Registrar Of Companies",
+     "Companies Law (Revised)", "Exempted Company"),
+    (["Delaware", "United States", "Usa", "Delaware, Usa", "U.S.A.", "United States Of America"],
+     "Delaware Secretary Of State", "Delaware General Corporation Law", "Corporation"),
+    (["Netherlands", "The Netherlands", "NETHERLANDS", "Holland"], "Kamer Van Koophandel", "Dutch Civil Code",
+     "Besloten Vennootschap"),
+    (["Ireland", "Republic Of Ireland", "IRELAND", "Eire"], "Companies Registration Office", "Companies Act 2014",
+     "Private Company Limited By Shares"),
+    (["Germany", "GERMANY", "Deutschland"], "Handelsregister", "German Law", "Gmbh"),
+    (["France", "FRANCE"], "Registre Du Commerce Et Des Societes", "French Commercial Code", "Sas"),
+    (["Switzerland", "SWITZERLAND"], "Commercial Register", "Swiss Code Of Obligations", "Ag"),
+    (["Cyprus", "CYPRUS"], "Registrar Of Companies Cyprus", "Cyprus Companies Law Cap. 113", "Private Limited Company"),
+    (["Gibraltar"], "Companies House Gibraltar", "Companies Act 2014 (Gibraltar)", "Private Company"),
+    (["Hong Kong", "HONG KONG"], "Companies Registry", "Companies Ordinance", "Private Company Limited By Shares"),
+    (["Singapore"], "Accounting And Corporate Regulatory Authority", "Companies Act (Cap. 50)", "Private Limited Company"),
+    (["United Arab Emirates", "Uae", "Dubai, Uae"], "Dubai Multi Commodities Centre", "DMCC Company Regulations", "Llc"),
+]
+
+NAME_WORDS = ["Acorn", "Alpha", "Anchor", "Apex", "Arbor", "Atlas", "Beacon", "Birch", "Blue", "Bridge", "Capital",
+              "Castle", "Cedar", "Central", "Crown", "Delta", "Eagle", "East", "Falcon", "Forest", "Global", "Golden",
+              "Granite", "Green", "Harbour", "Heritage", "Highland", "Holdings", "Horizon", "Imperial", "Invest",
+              "Iron", "Kestrel", "Lake", "Liberty", "Lion", "Maple", "Meridian", "North", "Oak", "Ocean", "Orchard",
+              "Pacific", "Park", "Phoenix", "Pinnacle", "Premier", "Quay", "Red", "Ridge", "River", "Rock", "Royal",
+              "Silver", "Sovereign", "Star", "Sterling", "Summit", "Thames", "Trinity", "Union", "Vale", "Vanguard",
+              "Victoria", "West", "Willow", "York"]
+# Made-up words, so that names are as varied as real ones and rarely match a listing by chance
+NAME_SYLLABLES = ["al", "ar", "bel", "bra", "cor", "dan", "del", "ex", "fin", "gal", "hol", "ix", "kin", "lan",
+                  "lex", "mar", "mon", "nor", "nov", "or", "pra", "quin", "ra", "rex", "sal", "sen", "ta", "tor",
+                  "tri", "ul", "van", "ver", "vis", "wen", "xa", "yor", "zan", "zen", "on", "is"]
+UK_SUFFIXES = ["LIMITED", "LTD", "LTD.", "PLC", "LLP", "HOLDINGS LIMITED", "PROPERTIES LIMITED"]
+FOREIGN_SUFFIXES = ["Limited", "Ltd", "Inc.", "Inc", "Corp.", "Corporation", "S.A.", "S.A R.L.", "B.V.", "GmbH",
+                    "Holdings Ltd", "LLC", "AG", "Sarl", "Investments Limited"]
+FIRST_NAMES = ["James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "David", "Sarah",
+               "Ahmed", "Priya", "Wei", "Olga", "Kwame", "Fatima"]
+SURNAMES = ["Smith", "Jones", "Taylor", "Brown", "Williams", "Wilson", "Johnson", "Davies", "Patel", "Khan",
+            "Evans", "Thomas", "Roberts", "Walker", "Wright", "Chen"]
+STREETS = ["High Street", "Station Road", "Church Lane", "Victoria Road", "Green Lane", "Manor Road", "Park Road",
+           "Queens Road", "King Street", "Mill Lane", "Bishopsgate", "Fleet Street", "Baker Street"]
+TOWNS = ["London", "Manchester", "Birmingham", "Leeds", "Glasgow", "Edinburgh", "Bristol", "Cardiff", "Belfast",
+         "Liverpool", "Sheffield", "Nottingham", "Leicester", "Southampton", "Norwich", "Aberdeen"]
+FOREIGN_TOWNS = ["Road Town", "St Helier", "St Peter Port", "Douglas", "Luxembourg", "George Town", "Wilmington",
+                 "Amsterdam", "Dublin", "Berlin", "Paris", "Zug", "Limassol", "Gibraltar", "Hong Kong", "Singapore"]
+POSTCODE_AREAS = ["AB", "AL", "B", "BA", "BB", "BD", "BH", "BL", "BN", "BR", "BS", "CA", "CB", "CF", "CH", "CM",
+                  "CO", "CR", "CT", "CV", "CW", "DA", "DD", "DE", "DH", "DL", "DN", "DT", "DY", "E", "EC", "EH",
+                  "EN", "EX", "FK", "G", "GL", "GU", "HA", "HD", "HG", "HP", "HR", "HU", "HX", "IG", "IP", "KA",
+                  "KT", "KY", "L", "LA", "LE", "LL", "LN", "LS", "LU", "M", "ME", "MK", "N", "NE", "NG", "NN",
+                  "NP", "NR", "NW", "OL", "OX", "PE", "PL", "PO", "PR", "RG", "RH", "RM", "S", "SE", "SG", "SK",
+                  "SL", "SM", "SN", "SO", "SS", "ST", "SW", "SY", "TA", "TN", "TQ", "TS", "TW", "UB", "W", "WA",
+                  "WC", "WD", "WF", "WN", "WR", "WS", "WV", "YO"]
+POSTCODE_UNIT_LETTERS = "ABDEFGHJLNPQRSTUWXYZ"
+COMPANY_STATUSES = ["Active"] * 90 + ["Active - Proposal to Strike off"] * 4 + ["Liquidation"] * 4 + ["In Administration"] * 2
+ACCOUNTS_CATEGORIES = ["TOTAL EXEMPTION FULL", "MICRO ENTITY", "DORMANT", "SMALL", "FULL", "GROUP",
+                       "UNAUDITED ABRIDGED", "NO ACCOUNTS FILED", "ACCOUNTS TYPE NOT AVAILABLE"]
+SIC_TEXTS = ["70100 - Activities of head offices", "64209 - Activities of other holding companies n.e.c.",
+             "68209 - Other letting and operating of own or leased real estate", "68100 - Buying and selling of own real estate",
+             "62020 - Information technology consultancy activities", "82990 - Other business support service activities n.e.c.",
+             "41100 - Development of building projects", "99999 - Dormant Company", "46900 - Non-specialised wholesale trade",
+             "64999 - Financial intermediation not elsewhere classified"]
+NATURES_OF_CONTROL = ["ownership-of-shares-25-to-50-percent", "ownership-of-shares-50-to-75-percent",
+                      "ownership-of-shares-75-to-100-percent", "voting-rights-75-to-100-percent",
+                      "right-to-appoint-and-remove-directors", "significant-influence-or-control"]
+STATEMENTS = ["no-individual-or-entity-with-signficant-control", "psc-details-not-confirmed",
+              "steps-to-find-psc-not-yet-completed"]
+
+BASIC_COMPANY_DATA_HEADER = (
+    ["CompanyName", " CompanyNumber", "RegAddress.CareOf", "RegAddress.POBox", "RegAddress.AddressLine1",
+     " RegAddress.AddressLine2", "RegAddress.PostTown", "RegAddress.County", "RegAddress.Country", "RegAddress.PostCode",
+     "CompanyCategory", "CompanyStatus", "CountryOfOrigin", "DissolutionDate", "IncorporationDate",
+     "Accounts.AccountRefDay", "Accounts.AccountRefMonth", "Accounts.NextDueDate", "Accounts.LastMadeUpDate",
+     "Accounts.AccountCategory", "Returns.NextDueDate", "Returns.LastMadeUpDate", "Mortgages.NumMortCharges",
+     "Mortgages.NumMortOutstanding", "Mortgages.NumMortPartSatisfied", "Mortgages.NumMortSatisfied",
+     "SICCode.SicText_1", "SICCode.SicText_2", "SICCode.SicText_3", "SICCode.SicText_4",
+     "LimitedPartnerships.NumGenPartners", "LimitedPartnerships.NumLimPartners", "URI"]
+    + [f" PreviousName_{i}.{field}" for i in range(1, 11) for field in ("CONDATE", "CompanyName")]
+    + ["ConfStmtNextDueDate", " ConfStmtLastMadeUpDate"]
+)
+
+LISTING_FILES = {
+    "uk": "pscs_uk_listed_companies.txt",
+    "nasdaq": "pscs_nasdaqlisted.txt",
+    "nyse": "pscs_nyse-listed.csv",
+    "other": "pscs_other-listed.csv",
+    "global": "Global_stock_listings_by_exchange_174.csv",
+}
+
+SNAPSHOT_AS_OF = date(2025, 3, 1)
+
+
+def postcode_parts(index):
+    """The index'th postcode of the synthetic pool, as (outward code, inward code). All distinct."""
+    area = POSTCODE_AREAS[index % len(POSTCODE_AREAS)]
+    index //= len(POSTCODE_AREAS)
+    district = index % 30 + 1
+    index //= 30
+    sector = index % 10
+    index //= 10
+    unit = POSTCODE_UNIT_LETTERS[index % 20] + POSTCODE_UNIT_LETTERS[index // 20 % 20]
+    return f"{area}{district}", f"{sector}{unit}"
+
+
+def postcode_coordinates(index):
+    """Eastings and northings for a pool postcode, spread across Great Britain."""
+    return 80_000 + (index * 7_919) % 560_000, 10_000 + (index * 104_729) % 950_000
+
+
+def format_date(value):
+    return value.strftime("%d/%m/%Y") if value else ""
+
+
+def name_stem(rng):
+    """A made-up word, often followed by one or two ordinary ones: "Vantrex Capital"."""
+    word = "".join(rng.choice(NAME_SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+    return " ".join([word] + rng.sample(NAME_WORDS, rng.choice((0, 1, 1, 2))))
+
+
+def company_name(rng):
+    return f"{name_stem(rng).upper()} {rng.choice(UK_SUFFIXES)}"
+
+
+def foreign_name(rng):
+    return f"{name_stem(rng)} {rng.choice(FOREIGN_SUFFIXES)}"
+
+
+def listing_names(rng, count):
+    """Names for a listing file: mostly foreign-style names, distinct."""
+    names = set()
+    while len(names) < count:
+        names.add(foreign_name(rng) if rng.random() < 0.8 else company_name(rng).title())
+    return sorted(names)
+
+
+def varied(rng, value):
+    """The same value as it might be typed: case changes and stray spaces."""
+    roll = rng.random()
+    if roll < 0.15:
+        return value.upper()
+    if roll < 0.25:
+        return value.lower()
+    if roll < 0.3:
+        return f" {value} "
+    return value
+
+
+def company_row(rng, number, n_postcodes):
+    """A BasicCompanyData row (a dict keyed by header name) for a new company."""
+    roll = rng.random()
+    if roll < MISSING_POSTCODE_SHARE:
+        postcode = ""
+    elif roll < MISSING_POSTCODE_SHARE + INVALID_POSTCODE_SHARE:
+        postcode = f"ZZ{rng.randint(1, 99)} {rng.randint(0, 9)}ZZ"
+    else:
+        outward, inward = postcode_parts(rng.randrange(n_postcodes))
+        postcode = f"{outward} {inward}"
+        if rng.random() < 0.05:
+            postcode = postcode.lower()
+    incorporated = SNAPSHOT_AS_OF - timedelta(days=rng.randint(30, 40 * 365))
+    category = rng.choice(ACCOUNTS_CATEGORIES)
+    next_due = SNAPSHOT_AS_OF + timedelta(days=rng.randint(-200, 300))
+    row = dict.fromkeys(BASIC_COMPANY_DATA_HEADER, "")
+    row.update({
+        "CompanyName": company_name(rng),
+        " CompanyNumber": number,
+        "RegAddress.AddressLine1": f"{rng.randint(1, 300)} {rng.choice(STREETS)}",
+        "RegAddress.PostTown": rng.choice(TOWNS).upper(),
+        "RegAddress.Country": rng.choice(["UNITED KINGDOM", "ENGLAND", ""]),
+        "RegAddress.PostCode": postcode,
+        "CompanyCategory": "Private Limited Company",
+        "CompanyStatus": rng.choice(COMPANY_STATUSES),
+        "CountryOfOrigin": "United Kingdom",
+        "IncorporationDate": format_date(incorporated),
+        "Accounts.AccountRefDay": str(rng.randint(1, 28)),
+        "Accounts.AccountRefMonth": str(rng.randint(1, 12)),
+        "Accounts.NextDueDate": "" if category == "NO ACCOUNTS FILED" else format_date(next_due),
+        "Accounts.AccountCategory": category,
+        "Mortgages.NumMortCharges": "0",
+        "Mortgages.NumMortOutstanding": "0",
+        "Mortgages.NumMortPartSatisfied": "0",
+        "Mortgages.NumMortSatisfied": "0",
+        "URI": f"http://business.data.gov.uk/id/company/{number}",
+        "ConfStmtNextDueDate": format_date(next_due),
+    })
+    for i, sic in enumerate(rng.sample(SIC_TEXTS, rng.randint(1, 2)), start=1):
+        row[f"SICCode.SicText_{i}"] = sic
+    if rng.random() < 0.2:
+        row[" PreviousName_1.CONDATE"] = format_date(incorporated + timedelta(days=rng.randint(1, (SNAPSHOT_AS_OF - incorporated).days)))
+        row[" PreviousName_1.CompanyName"] = company_name(rng)
+    return row
+
+
+def psc_common(rng, company_number, kind, kind_path):
+    psc_id = "%032x" % rng.getrandbits(128)
+    return {
+        "etag": "%040x" % rng.getrandbits(160),
+        "kind": kind,
+        "links": {"self": f"/company/{company_number}/persons-with-significant-control/{kind_path}/{psc_id}"},
+        "notified_on": (SNAPSHOT_AS_OF - timedelta(days=rng.randint(0, 3200))).isoformat(),
+    }
+
+
+def individual_psc(rng, company_number):
+    title, first, last = rng.choice(["Mr", "Mrs", "Ms", "Dr"]), rng.choice(FIRST_NAMES), rng.choice(SURNAMES)
+    data = psc_common(rng, company_number, "individual-person-with-significant-control", "individual")
+    data.update({
+        "address": {"address_line_1": rng.choice(STREETS), "country": "England", "locality": rng.choice(TOWNS),
+                    "postal_code": "", "premises": str(rng.randint(1, 300))},
+        "country_of_residence": rng.choice(["England", "United Kingdom", "Scotland", "France", "United States"]),
+        "date_of_birth": {"month": rng.randint(1, 12), "year": rng.randint(1940, 2000)},
+        "name": f"{title} {first} {last}",
+        "name_elements": {"forename": first, "surname": last, "title": title},
+        "nationality": rng.choice(["British", "Irish", "French", "American", "Indian", "Chinese"]),
+        "natures_of_control": rng.sample(NATURES_OF_CONTROL, rng.randint(1, 3)),
+    })
+    return {"company_number": company_number, "data": data}
+
+
+def statement(rng, company_number):
+    data = psc_common(rng, company_number, "persons-with-significant-control-statement", "statements")
+    data["statement"] = rng.choice(STATEMENTS)
+    return {"company_number": company_number, "data": data}
+
+
+def corporate_psc(rng, company_number, non_uk, listed_names):
+    """A corporate PSC, registered outside the UK if non_uk, sometimes named after a listed company."""
+    data = psc_common(rng, company_number, CORPORATE_KIND, "corporate-entity")
+    if non_uk:
+        countries, place, authority, form = rng.choice(NON_UK_COUNTRIES)
+        country = rng.choice(countries)
+        identification = {"country_registered": varied(rng, country), "place_registered": varied(rng, place),
+                          "legal_authority": authority, "legal_form": form,
+                          "registration_number": str(rng.randint(10_000, 9_999_999))}
+        if rng.random() < UK_ADDRESS_SHARE:
+            address = {"address_line_1": rng.choice(STREETS), "country": rng.choice(["United Kingdom", "England"]),
+                       "locality": rng.choice(TOWNS), "premises": str(rng.randint(1, 300))}
+        else:
+            address = {"address_line_1": rng.choice(STREETS), "country": country,
+                       "locality": rng.choice(FOREIGN_TOWNS), "premises": str(rng.randint(1, 300))}
+        if rng.random() < LISTED_SHARE:
+            name = rng.choice(listed_names)
+        else:
+            name = foreign_name(rng)
+    else:
+        identification = {"country_registered": varied(rng, rng.choice(UK_COUNTRIES)),
+                          "place_registered": rng.choice(UK_PLACES), "legal_authority": "Companies Act 2006",
+                          "legal_form": "Private Limited Company",
+                          "registration_number": f"{rng.randint(1, 16_000_000):08d}"}
+        # Some UK corporate PSCs don't give a country at all
+        if rng.random() < 0.05:
+            del identification["country_registered"]
+        address = {"address_line_1": rng.choice(STREETS), "country": "United Kingdom",
+                   "locality": rng.choice(TOWNS), "premises": str(rng.randint(1, 300))}
+        name = company_name(rng)
+    data.update({"address": address, "identification": identification, "name": name,
+                 "natures_of_control": rng.sample(NATURES_OF_CONTROL, rng.randint(1, 3))})
+    return {"company_number": company_number, "data": data}
+
+
+def write_listings(directory, rng):
+    """Write the listed company files. Returns all the names in them."""
+    listings = {market: listing_names(rng, size) for market, size in LISTING_SIZES.items()}
+    with open(os.path.join(directory, LISTING_FILES["uk"]), "w", encoding="utf-8") as f:
+        f.writelines(f"{name}\n" for name in listings["uk"])
+    with open(os.path.join(directory, LISTING_FILES["nasdaq"]), "w", encoding="utf-8") as f:
+        f.write("Symbol|Security Name|Market Category|Test Issue|Financial Status|Round Lot Size|ETF|NextShares\n")
+        f.writelines(f"N{i}|{name} - Common Stock|Q|N|N|100|N|N\n" for i, name in enumerate(listings["nasdaq"]))
+    for market in ("nyse", "other"):
+        with open(os.path.join(directory, LISTING_FILES[market]), "w", encoding="utf-8") as f:
+            f.write("ACT Symbol,Company Name\n")
+            f.writelines(f"{market[0].upper()}{i},{name}\n" for i, name in enumerate(listings[market]))
+    with open(os.path.join(directory, LISTING_FILES["global"]), "w", encoding="utf-8") as f:
+        f.write("Exchange,Symbol,Name,Country\n")
+        f.writelines(f"X{i % 174},G{i},{name},Somewhere\n" for i, name in enumerate(listings["global"]))
+    return [name for names in listings.values() for name in names]
+
+
+def write_codepoint(directory, n_postcodes):
+    """Write the pool's postcodes as Code-Point Open CSVs, one per postcode area as the real ones are."""
+    folder = os.path.join(directory, CODEPOINT_CSV_FOLDER)
+    os.makedirs(folder, exist_ok=True)
+    files = {area: open(os.path.join(folder, f"{area.lower()}.csv"), "w", newline="", encoding="utf-8")
+             for area in POSTCODE_AREAS}
+    try:
+        writers = {area: csv.writer(f, quoting=csv.QUOTE_NONNUMERIC) for area, f in files.items()}
+        for index in range(n_postcodes):
+            outward, inward = postcode_parts(index)
+            easting, northing = postcode_coordinates(index)
+            writers[POSTCODE_AREAS[index % len(POSTCODE_AREAS)]].writerow(
+                [f"{outward:<4}{inward}", 10, easting, northing, "E92000001", "", "E19000001", "", "E18000007",
+                 "", "E09000001", "E05000001"])
+    finally:
+        for f in files.values():
+            f.close()
+
+
+def generate(directory, records, seed=SYNTHETIC_SEED, corporate_share=CORPORATE_SHARE, non_uk_share=NON_UK_SHARE):
+    """
+    Write a synthetic data set of about `records` PSC snapshot lines to directory.
+    Returns (and writes to MANIFEST_FILE) its parameters and counts.
+    """
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(directory, os.path.dirname(PSC_SNAPSHOT_FILE)), exist_ok=True)
+    listed_names = write_listings(directory, rng)
+    # Spread over every company we might create
+    n_postcodes = max(min(records // (2 * COMPANIES_PER_POSTCODE), MAX_POSTCODES), 100)
+    write_codepoint(directory, n_postcodes)
+
+    counts = {"lines": 0, "companies": 0, "corporate_pscs": 0, "non_uk_corporate_pscs": 0, "statements": 0}
+    with open(os.path.join(directory, PSC_SNAPSHOT_FILE), "w", encoding="utf-8") as snapshot, \
+            open(os.path.join(directory, SNAPSHOT_FILE), "w", newline="", encoding="utf-8") as companies:
+        company_writer = csv.DictWriter(companies, BASIC_COMPANY_DATA_HEADER)
+        company_writer.writeheader()
+        while counts["lines"] < records:
+            counts["companies"] += 1
+            number = f"{counts['companies']:08d}"
+            company_writer.writerow(company_row(rng, number, n_postcodes))
+            for _ in range(min(rng.randint(1, MAX_PSCS_PER_COMPANY), records - counts["lines"])):
+                roll = rng.random()
+                if roll < corporate_share:
+                    non_uk = rng.random() < non_uk_share
+                    psc = corporate_psc(rng, number, non_uk, listed_names)
+                    counts["corporate_pscs"] += 1
+                    counts["non_uk_corporate_pscs"] += non_uk
+                elif roll < corporate_share + STATEMENT_SHARE:
+                    psc = statement(rng, number)
+                    counts["statements"] += 1
+                else:
+                    psc = individual_psc(rng, number)
+                snapshot.write(json.dumps(psc, separators=(",", ":")))
+                snapshot.write("\n")
+                counts["lines"] += 1
+        # The real snapshot ends with a summary line
+        snapshot.write(json.dumps({"data": {"kind": "totals#persons-of-significant-control-snapshot",
+                                            "persons_of_significant_control_count": counts["lines"]}},
+                                  separators=(",", ":")) + "\n")
+
+    manifest = {"records": records, "seed": seed, "corporate_share": corporate_share,
+                "non_uk_share": non_uk_share, "postcodes": n_postcodes, **counts}
+    with open(os.path.join(directory, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def stand_in_for_names_and_geodata(input_file, output_file, snapshot_file=SNAPSHOT_FILE, seed=SYNTHETIC_SEED):
+    """
+    What pscs_find_geodata and pscs_add_names would add to the non-UK corporate PSCs: coordinates
+    for the PSC's address and the company's name and accounts details, from the synthetic
+    company data. Liquidated companies are dropped, as add_names does.
+    """
+    rng = random.Random(seed)
+    companies = load_company_snapshot((record.get("company_number") for record in read_records(input_file)),
+                                      snapshot_file)
+
+    def records():
+        for record in read_records(input_file):
+            details = companies.get(record.get("company_number"))
+            if details is None or details.get("has_been_liquidated"):
+                continue
+            record["latitude"], record["longitude"] = rng.uniform(-50, 60), rng.uniform(-120, 140)
+            record["company_details"] = {
+                "company_name": details["company_name"],
+                "accounts_overdue": details.get("accounts_overdue", False),
+                "accounts_type": details["accounts_type"],
+                "registered_office_is_in_dispute": False,
+                "undeliverable_registered_office_address": False,
+            }
+            yield record
+
+    return write_records(output_file, records())
+
+
+def stand_in_for_uk_addresses(input_file, output_file, snapshot_file=SNAPSHOT_FILE):
+    """
+    What pscs_add_UK_addresses_with_api.py would add: the company's registered office, but not
+    its coordinates, so that the postcode stage has them all to find.
+    """
+    companies = load_company_snapshot((record.get("company_number") for record in read_records(input_file)),
+                                      snapshot_file)
+
+    def records():
+        for record in read_records(input_file):
+            details = companies.get(record.get("company_number"))
+            if details is not None:
+                record["company_details"]["postcode"] = details["postcode"]
+                record["company_details"]["address"] = details["address"]
+            yield record
+
+    return write_records(output_file, records())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic Companies House data set.")
+    parser.add_argument("directory")
+    parser.add_argument("--records", type=int, default=10_000, help="PSC snapshot lines")
+    parser.add_argument("--seed", type=int, default=SYNTHETIC_SEED)
+    parser.add_argument("--corporate-share", type=float, default=CORPORATE_SHARE)
+    parser.add_argument("--non-uk-share", type=float, default=NON_UK_SHARE)
+    args = parser.parse_args()
+    manifest = generate(args.directory, args.records, args.seed, args.corporate_share, args.non_uk_share)
+    print(json.dumps(manifest, indent=2))
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Shared test for whether a country / place of registration refers to the UK.
+
+Used by pscs_find_non-UK_corporates and pscs_remove_uk_pscs.py. The snapshot contains millions
+of corporate PSCs but only a few thousand distinct country strings, so verdicts are cached per
+normalized string and a cache miss scores the string against every term in one rapidfuzz call.
+"""
+from functools import lru_cache
+from rapidfuzz import fuzz, process
+
+# Maximum number of distinct normalized strings whose verdict is remembered.
+CACHE_SIZE = 100_000
+
+UK_TERMS = (
+    "uk", "england", "scotland", "wales", "northern ireland", "united kingdom",
+    "england and wales", "england & wales", "united kingdom (england and wales)",
+    "uk and wales", "united kingdom england", "u.k", "england, uk",
+    "scotland united kingdom", "gbeng", "gbsct", "great britain", "united kingdom (scotland)", "london",
+    "gbr", "cardiff", "e&w", "england, united kingdom", "britain", "uk/england", "cardiff, wales", "uk/scotland",
+    "gb", "companies house", "n. ireland", "edinburgh", "uk, yorkshire", "Companies House - Registrar Of Companies",
+    "Northern Ireland, United Kingdom", "london, england", "belfast", "eng", "u k", "england and wales, england",
+    "west yorkshire "
+)
+
+# pscs_remove_uk_pscs.py also checks address country, legal authority and legal form, which
+# throw up a few more UK variants.
+UK_TERMS_EXTENDED = UK_TERMS + ("scottish", "Wales Uk", "cymru", "suffolk", "Law Of England And Wales")
+
+
+def normalize_country(country):
+    return country.lower().replace("registered in", "").strip()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _matches_uk_term(normalized, extended, threshold):
+    # extractOne gives up on a term as soon as it can't reach score_cutoff,
+    # and returns None if no term scores at least threshold.
+    terms = UK_TERMS_EXTENDED if extended else UK_TERMS
+    best = process.extractOne(normalized, terms, scorer=fuzz.ratio, processor=None, score_cutoff=threshold)
+    return best is not None
+
+
+def is_uk_a_fuzzy_match(country, threshold=85, extended=False):
+    """
+    Determine if a country string is considered UK by fuzzy matching.
+    extended=True also checks UK_TERMS_EXTENDED. Empty values are never UK.
+    """
+    if not country:
+        return False
+    return _matches_uk_term(normalize_country(country), extended, threshold)
+
+
+def cache_stats():
+    """Return (hits, misses) for the verdict cache in this process."""
+    info = _matches_uk_term.cache_info()
+    return info.hits, info.misses
+
+
+def format_cache_stats(hits, misses):
+    lookups = hits + misses
+    hit_rate = hits / lookups if lookups else 0
+    return f"UK country cache: {lookups} lookups, {misses} distinct strings scored, {hit_rate:.2%} hit rate"